@@ -1,64 +1,102 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, Response, stream_with_context
+from markupsafe import Markup
+from datetime import datetime, timedelta, timezone
+import io
 import json
+import logging
+import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from models import (db, GridSubstation, SubstationForecast, SubstationForecastArchive, SubstationForecastHourly,
+                    SubstationForecastDaily, SubstationForecastState, SolarPlant)
+from queries import (plants_with_substation, iter_substation_forecasts, FORECAST_BUCKETS,
+                     plant_page, substation_page, search_substations, PLANT_SORTS, SUBSTATION_SORTS,
+                     MAX_PER_PAGE, points_in_bbox, clusters_in_bbox, within_km, nearest, map_center,
+                     plant_point, substation_point)
+from spatial import cluster_degrees
+from forecasting import refresh_generation_forecasts
+import scheduler
+from rollups import substation_summary, rebuild_rollups, today
+from maintenance import upgrade_database, archive_forecasts
+from ingest import ingest_forecasts, format_for, IngestError, FORMATS
+from synthetic_data import generate_fleet
+from cache import cache
+from config import configure_database, configure_engines, read_replica
+from metrics import metrics
 
 app = Flask(__name__)
 
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_fallback_secret_key_here')
-database_url = os.environ.get('DATABASE_URL')
-if database_url and database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'sqlite:///solar_plants.db'
+configure_database(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['GOOGLE_MAPS_API_KEY'] = os.environ.get('GOOGLE_MAPS_API_KEY', 'your_fallback_api_key_here')
 
-db = SQLAlchemy(app)
-
-# Models
-class GridSubstation(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    code = db.Column(db.String(50), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
-    current_load = db.Column(db.Float)
-    solar_plants = db.relationship('SolarPlant', backref='grid_substation', lazy=True)
-
-class SubstationForecast(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False)
-    generation_forecast = db.Column(db.Float)
-    load_forecast = db.Column(db.Float)
-    substation = db.relationship('GridSubstation', backref=db.backref('forecasts', lazy=True))
-
-class SolarPlant(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    size = db.Column(db.Float, nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
-    angle = db.Column(db.Float, nullable=False)
-    max_power = db.Column(db.Float, nullable=False)
-    owner_name = db.Column(db.String(100), nullable=False)
-    owner_account = db.Column(db.String(50), nullable=False)
-    grid_substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), nullable=False)
-    connected_feeder = db.Column(db.String(100), nullable=False)
+db.init_app(app)
+configure_engines(app, db)
+cache.init_app(app)
+metrics.init_app(app, db)
+
+def render_fragment(name, tags, template, build_context, parts=()):
+    """Render ``template`` once per version of ``tags`` and reuse the HTML until they change."""
+    key = cache.key(name, tags, *parts)
+    return Markup(cache.get_or_set(key, lambda: render_template(template, **build_context())))
 
 # Routes
 @app.route('/')
+@read_replica
 def index():
-    plants = SolarPlant.query.order_by(SolarPlant.id.desc()).limit(10).all()
-    return render_template('index.html', plants=plants)
+    plants_table = render_fragment('recent_plants', ('plants', 'substations'), '_recent_plants_table.html', lambda: {
+        'plants': plants_with_substation(SolarPlant.query.order_by(SolarPlant.id.desc()).limit(10))
+    })
+    start_day = today()
+    summary_table = render_fragment('forecast_summary', ('forecasts', 'substations'), '_forecast_summary.html',
+                                    lambda: {'summaries': substation_summary(start_day, 3), 'start_day': start_day},
+                                    parts=(start_day.date(),))
+    return render_template('index.html', plants_table=plants_table, summary_table=summary_table)
+
+def _listing_args(sorts):
+    sort = request.args.get('sort', 'name')
+    if sort not in sorts:
+        abort(400, description=f"Invalid 'sort': expected one of {', '.join(sorts)}.")
+    return {
+        'sort': sort,
+        'descending': request.args.get('order') == 'desc',
+        'after': request.args.get('after') or None,
+        'per_page': max(1, min(request.args.get('per_page', 50, type=int), MAX_PER_PAGE))
+    }
+
+def _page_context(name, page, **listing):
+    try:
+        rows, next_cursor = page(**listing)
+    except ValueError as e:
+        abort(400, description=str(e))
+    next_args = dict(request.args.items(), after=next_cursor) if next_cursor else None
+    return {name: rows, 'next_args': next_args}
+
+def _fragment_parts():
+    return sorted(request.args.items(multi=True))
 
 # CRUD for Solar Plants
 @app.route('/plants')
+@read_replica
 def list_plants():
-    plants = SolarPlant.query.all()
-    return render_template('list_plants.html', plants=plants)
+    listing = _listing_args(PLANT_SORTS)
+    listing.update(
+        substation_id=request.args.get('substation', type=int),
+        feeder=request.args.get('feeder') or None,
+        owner=request.args.get('owner') or None,
+        min_size=request.args.get('min_size', type=float),
+        max_size=request.args.get('max_size', type=float)
+    )
+    plants_table = render_fragment('plants', ('plants', 'substations'), '_plants_table.html',
+                                   lambda: _page_context('plants', plant_page, **listing),
+                                   parts=_fragment_parts())
+    filter_substation = db.session.get(GridSubstation, listing['substation_id']) if listing['substation_id'] else None
+    return render_template('list_plants.html', plants_table=plants_table, filter_substation=filter_substation)
 
 @app.route('/plant/add', methods=['GET', 'POST'])
 def add_plant():
@@ -77,10 +115,10 @@ def add_plant():
         )
         db.session.add(new_plant)
         db.session.commit()
+        cache.invalidate('plants')
         flash('New solar plant added successfully!', 'success')
         return redirect(url_for('list_plants'))
-    substations = GridSubstation.query.all()
-    return render_template('add_plant.html', substations=substations)
+    return render_template('add_plant.html')
 
 @app.route('/plant/edit/<int:id>', methods=['GET', 'POST'])
 def edit_plant(id):
@@ -97,25 +135,31 @@ def edit_plant(id):
         plant.grid_substation_id = int(request.form['grid_substation'])
         plant.connected_feeder = request.form['connected_feeder']
         db.session.commit()
+        cache.invalidate('plants')
         flash('Solar plant updated successfully!', 'success')
         return redirect(url_for('list_plants'))
-    substations = GridSubstation.query.all()
-    return render_template('edit_plant.html', plant=plant, substations=substations)
+    return render_template('edit_plant.html', plant=plant)
 
 @app.route('/plant/delete/<int:id>', methods=['POST'])
 def delete_plant(id):
     plant = SolarPlant.query.get_or_404(id)
     db.session.delete(plant)
     db.session.commit()
+    cache.invalidate('plants')
     flash('Solar plant deleted successfully!', 'success')
     return redirect(url_for('list_plants'))
 
 # CRUD for Grid Substations
 
 @app.route('/substations')
+@read_replica
 def list_substations():
-    substations = GridSubstation.query.all()
-    return render_template('list_substations.html', substations=substations)
+    listing = _listing_args(SUBSTATION_SORTS)
+    listing.update(q=request.args.get('q') or None)
+    substations_table = render_fragment('substations', ('substations',), '_substations_table.html',
+                                        lambda: _page_context('substations', substation_page, **listing),
+                                        parts=_fragment_parts())
+    return render_template('list_substations.html', substations_table=substations_table)
 
 
 @app.route('/substation/add', methods=['GET', 'POST'])
@@ -130,6 +174,7 @@ def add_substation():
         )
         db.session.add(new_substation)
         db.session.commit()
+        cache.invalidate('substations')
         flash('New grid substation added successfully!', 'success')
         return redirect(url_for('list_substations'))
     return render_template('add_substation.html')
@@ -144,6 +189,7 @@ def edit_substation(id):
         substation.longitude = float(request.form['longitude'])
         substation.current_load = float(request.form['current_load'])
         db.session.commit()
+        cache.invalidate('substations')
         flash('Grid substation updated successfully!', 'success')
         return redirect(url_for('list_substations'))
     return render_template('edit_substation.html', substation=substation)
@@ -154,57 +200,268 @@ def delete_substation(id):
     if SolarPlant.query.filter_by(grid_substation_id=id).first():
         flash('Cannot delete substation. It has associated solar plants.', 'error')
     else:
+        # Forecasts, their rollups and the scheduler's state all reference the substation.
+        for model in (SubstationForecast, SubstationForecastArchive, SubstationForecastHourly,
+                      SubstationForecastDaily, SubstationForecastState):
+            model.query.filter_by(substation_id=id).delete(synchronize_session=False)
         db.session.delete(substation)
         db.session.commit()
+        cache.invalidate('substations', 'forecasts')
         flash('Grid substation deleted successfully!', 'success')
     return redirect(url_for('list_substations'))
 
 @app.route('/map')
+@read_replica
 def map_view():
-    plants = SolarPlant.query.all()
-    substations = GridSubstation.query.all()
-    
-    current_time = datetime.utcnow()
-    forecast_end = current_time + timedelta(days=3)
-    
-    plants_data = [{
-        'id': plant.id,
-        'name': plant.name,
-        'latitude': plant.latitude,
-        'longitude': plant.longitude,
-        'size': plant.size,
-        'angle': plant.angle,
-        'max_power': plant.max_power,
-        'owner_name': plant.owner_name,
-        'grid_substation': plant.grid_substation.name,
-        'connected_feeder': plant.connected_feeder
-    } for plant in plants]
-
-    substations_data = [{
-        'id': sub.id,
-        'name': sub.name,
-        'code': sub.code,
-        'latitude': sub.latitude,
-        'longitude': sub.longitude,
-        'current_load': sub.current_load,
-        'forecasts': [{
-            'timestamp': f.timestamp.isoformat(),
-            'generation_forecast': f.generation_forecast,
-            'load_forecast': f.load_forecast
-        } for f in SubstationForecast.query.filter(
-            SubstationForecast.substation_id == sub.id,
-            SubstationForecast.timestamp.between(current_time, forecast_end)
-        ).order_by(SubstationForecast.timestamp).all()]
-    } for sub in substations]
-
-    return render_template('map.html', 
-                           plants_json=json.dumps(plants_data),
-                           substations_json=json.dumps(substations_data))
+    key = cache.key('map', ('plants', 'substations'))
+    etag = cache.etag(key)
+    if etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+    center_latitude, center_longitude = cache.get_or_set(key, map_center)
+    response = app.make_response(render_template('map.html',
+                                                 center_latitude=center_latitude or 0,
+                                                 center_longitude=center_longitude or 0))
+    response.set_etag(etag)
+    return response
+
+# JSON API
+def _parse_datetime_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        value = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f'Invalid {name!r}: expected an ISO 8601 timestamp.')
+    if value.tzinfo is not None:
+        # Forecast timestamps are stored as naive UTC.
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+@app.route('/api/substations/<int:id>/forecasts')
+@read_replica
+def substation_forecasts(id):
+    substation = GridSubstation.query.get_or_404(id)
+    start = _parse_datetime_arg('start', datetime.utcnow())
+    end = _parse_datetime_arg('end', start + timedelta(days=3))
+    bucket = request.args.get('bucket') or None
+    if bucket is not None and bucket not in FORECAST_BUCKETS:
+        abort(400, description=f"Invalid 'bucket': expected one of {', '.join(FORECAST_BUCKETS)}.")
+
+    header = json.dumps({
+        'substation': {'id': substation.id, 'name': substation.name, 'code': substation.code},
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket
+    })
+
+    def generate():
+        # Stream the envelope and one forecast at a time instead of building the whole list.
+        yield header[:-1] + ', "forecasts": ['
+        for i, forecast in enumerate(iter_substation_forecasts(id, start, end, bucket)):
+            yield (',' if i else '') + json.dumps(forecast)
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/substations/search')
+@read_replica
+def search_substations_api():
+    q = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    substations = search_substations(q, limit) if q else []
+    return {'substations': [{'id': sub.id, 'name': sub.name, 'code': sub.code} for sub in substations]}
+
+MAP_LAYERS = {'plants': (SolarPlant, plant_point), 'substations': (GridSubstation, substation_point)}
+MAX_MAP_POINTS = 5000
+
+def _map_layers():
+    layer = request.args.get('layer', 'all')
+    if layer == 'all':
+        return list(MAP_LAYERS)
+    if layer not in MAP_LAYERS:
+        abort(400, description=f"Invalid 'layer': expected all, {', '.join(MAP_LAYERS)}.")
+    return [layer]
+
+def _float_arg(name, limit=None):
+    value = request.args.get(name, type=float)
+    if value is None or not math.isfinite(value) or (limit is not None and abs(value) > limit):
+        abort(400, description=f'Missing or invalid {name!r}.')
+    return value
+
+@app.route('/api/map/points')
+@read_replica
+def map_points():
+    try:
+        south, west, north, east = (float(v) for v in request.args.get('bbox', '').split(','))
+    except ValueError:
+        abort(400, description="Invalid 'bbox': expected south,west,north,east.")
+    if (not all(map(math.isfinite, (south, west, north, east)))
+            or max(abs(south), abs(north)) > 90 or max(abs(west), abs(east)) > 180):
+        abort(400, description="Invalid 'bbox': latitudes must lie within ±90 and longitudes within ±180.")
+    zoom = request.args.get('zoom', type=int)
+    layers = _map_layers()
+    degrees = cluster_degrees(zoom)
+
+    def build():
+        payload = {'clustered': degrees is not None}
+        for layer in layers:
+            model, to_point = MAP_LAYERS[layer]
+            if degrees is not None:
+                payload[layer] = clusters_in_bbox(model, south, west, north, east, degrees)
+            else:
+                rows = points_in_bbox(model, south, west, north, east, MAX_MAP_POINTS + 1)
+                payload[layer] = [to_point(row) for row in rows[:MAX_MAP_POINTS]]
+                payload[layer + '_truncated'] = len(rows) > MAX_MAP_POINTS
+        return payload
+
+    key = cache.key('map_points', ('plants', 'substations'), layers, round(south, 4), round(west, 4),
+                    round(north, 4), round(east, 4), degrees)
+    etag = cache.etag(key)
+    if etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    response = app.make_response(cache.get_or_set(key, build))
+    response.set_etag(etag)
+    return response
+
+def _nearby(latitude, longitude, layers, exclude=None):
+    km = request.args.get('km', type=float)
+    if km is not None and not math.isfinite(km):
+        abort(400, description="Invalid 'km': expected a finite distance.")
+    limit = max(1, min(request.args.get('limit', 10, type=int), 500))
+    payload = {}
+    for layer in layers:
+        model, to_point = MAP_LAYERS[layer]
+        if km:
+            pairs = within_km(model, latitude, longitude, km)
+        else:
+            pairs = nearest(model, latitude, longitude, limit + (exclude is not None))
+        payload[layer] = [dict(to_point(row), distance_km=round(distance, 3))
+                          for row, distance in pairs if row is not exclude][:limit]
+    return payload
+
+@app.route('/api/map/nearby')
+@read_replica
+def map_nearby():
+    return _nearby(_float_arg('lat', 90), _float_arg('lng', 180), _map_layers())
+
+@app.route('/api/substations/<int:id>/nearby')
+@read_replica
+def substation_nearby(id):
+    substation = GridSubstation.query.get_or_404(id)
+    payload = _nearby(substation.latitude, substation.longitude, _map_layers(), exclude=substation)
+    payload['substation'] = substation_point(substation)
+    return payload
+
+@app.route('/api/summary')
+@read_replica
+def forecast_summary():
+    # Rollups are bucketed by day, so a start within a day means that whole day.
+    start_day = _parse_datetime_arg('start', today()).replace(hour=0, minute=0, second=0, microsecond=0)
+    days = max(1, min(request.args.get('days', 3, type=int), 31))
+    key = cache.key('summary', ('forecasts', 'substations'), start_day.isoformat(), days)
+    return {
+        'start': start_day.isoformat(),
+        'days': days,
+        'substations': cache.get_or_set(key, lambda: substation_summary(start_day, days))
+    }
+
+@app.route('/api/scheduler/status')
+@read_replica
+def scheduler_status():
+    return scheduler.status()
+
+@app.route('/api/forecasts/bulk', methods=['POST'])
+def bulk_forecasts():
+    fmt = request.args.get('format') or format_for(None, request.content_type)
+    if fmt not in FORMATS:
+        abort(415, description='Send text/csv or application/x-ndjson, or pass ?format=csv|jsonl.')
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+    try:
+        rows = ingest_forecasts(stream, fmt)
+    except IngestError as e:
+        return {'error': str(e), 'line': e.line, 'rows': e.rows}, 400
+    return {'rows': rows}
 
 # Database creation
 def create_tables():
     with app.app_context():
-        db.create_all()
+        upgrade_database()
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and indexes on an existing database."""
+    removed = upgrade_database()
+    click.echo(f'Database upgraded. Removed {removed} duplicate forecast rows.')
+
+@app.cli.command('archive-forecasts')
+@click.option('--older-than-days', type=int, required=True, help='Archive forecasts older than this many days.')
+def archive_forecasts_command(older_than_days):
+    """Move old forecasts out of the hot forecast table."""
+    moved = archive_forecasts(older_than_days)
+    click.echo(f'Archived {moved} forecast rows.')
+
+@app.cli.command('ingest-forecasts')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--chunk-size', type=int, default=5000, show_default=True)
+def ingest_forecasts_command(source, fmt, chunk_size):
+    """Upsert forecasts from a CSV or JSON Lines file ('-' for stdin)."""
+    fmt = fmt or format_for(source.name)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the format from the file name; pass --format.')
+    try:
+        rows = ingest_forecasts(source, fmt, chunk_size)
+    except IngestError as e:
+        raise click.ClickException(f'line {e.line}: {e} ({e.rows} rows written before the error)')
+    click.echo(f'Ingested {rows} forecast rows.')
+
+@app.cli.command('forecast-generation')
+@click.option('--days', type=int, default=3, show_default=True, help='Forecast horizon.')
+def forecast_generation_command(days):
+    """Recompute clear-sky generation forecasts for every substation."""
+    rows = refresh_generation_forecasts(days=days)
+    db.session.commit()
+    cache.invalidate('forecasts')
+    click.echo(f'Wrote {rows} generation forecast rows.')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the hourly and daily forecast rollups from scratch."""
+    rebuild_rollups()
+    db.session.commit()
+    cache.invalidate('forecasts')
+    click.echo('Forecast rollups rebuilt.')
+
+@app.cli.command('forecast-scheduler')
+@click.option('--interval', type=int, default=900, show_default=True, help='Seconds between runs.')
+@click.option('--workers', type=int, help='Worker processes; defaults to the CPU count.')
+@click.option('--days', type=int, default=3, show_default=True, help='Forecast horizon.')
+@click.option('--once', is_flag=True, help='Run a single refresh and exit.')
+def forecast_scheduler_command(interval, workers, days, once):
+    """Keep generation forecasts for the rolling window up to date."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if not once:
+        scheduler.run_forever(interval, workers, days)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        run = scheduler.run_once(executor, workers, days)
+    click.echo(f'Forecast refresh {run.status}: {run.substations_recomputed} substations, '
+               f'{run.rows_written} rows.')
+    if run.status != 'succeeded':
+        raise click.ClickException(run.error)
+
+@app.cli.command('generate-fleet')
+@click.option('--substations', type=int, default=100, show_default=True)
+@click.option('--plants', type=int, default=5000, show_default=True)
+@click.option('--days', type=int, default=3, show_default=True, help='Days of 15-minute forecasts.')
+@click.option('--seed', type=int, default=0, show_default=True)
+def generate_fleet_command(substations, plants, days, seed):
+    """Add a synthetic fleet of substations, plants and forecasts for load testing."""
+    counts = generate_fleet(substations, plants, days, seed=seed)
+    click.echo(f"Added {counts['substations']} substations, {counts['plants']} plants and "
+               f"{counts['forecasts']} forecast rows.")
 
 if __name__ == '__main__':
     create_tables()
@@ -0,0 +1,72 @@
+"""Scaling of the vectorized generation forecast from 10 to 100k plants.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_forecasting
+    python -m benchmarks.bench_forecasting --plants 10 1000 100000 --substations 500
+
+Each fleet is random plants spread over Sri Lanka, forecast on the
+3-day, 15-minute grid.  For the smaller fleets the same model is also
+evaluated one plant and one time step per call from a Python loop, the
+shape the old row-by-row sample data generator had.
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from forecasting import forecast_times, plant_output_kw, substation_generation_mw
+
+PER_ROW_LIMIT = 1000  # the plain-Python baseline gets too slow to be worth waiting for beyond this
+
+
+def random_fleet(plants, substations, rng):
+    size = rng.uniform(3, 500, plants)
+    return {
+        'grid_substation_id': rng.integers(1, substations + 1, plants),
+        'latitude': rng.uniform(5.9, 9.8, plants),
+        'longitude': rng.uniform(79.6, 81.9, plants),
+        'size': size,
+        'angle': rng.uniform(5, 35, plants),
+        'max_power': size * rng.uniform(0.7, 1.0, plants),
+    }
+
+
+def per_row(fleet, times):
+    # The same model through the vectorized code path, but one scalar plant/time pair at a time.
+    started = time.perf_counter()
+    for i in range(len(fleet['size'])):
+        for t in range(len(times)):
+            plant_output_kw(*(np.array([fleet[name][i]]) for name in
+                              ('latitude', 'longitude', 'size', 'angle', 'max_power')), times[t:t + 1])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--plants', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--substations', type=int, default=200)
+    parser.add_argument('--days', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    times = forecast_times(datetime(2030, 6, 1), args.days)
+    print(f'{len(times)} time steps, {args.substations} substations')
+    print(f'{"plants":>8} {"vectorized":>12} {"plant-steps/s":>15} {"per-row":>10} {"speed-up":>9}')
+    for plants in args.plants:
+        fleet = random_fleet(plants, args.substations, rng)
+        started = time.perf_counter()
+        substation_generation_mw(fleet, times)
+        vectorized = time.perf_counter() - started
+        line = f'{plants:>8} {vectorized:>11.3f}s {plants * len(times) / vectorized:>15,.0f}'
+        if plants <= PER_ROW_LIMIT:
+            sample = max(1, min(plants, 10))
+            # Time a sample of plants and scale up, so the baseline stays affordable.
+            elapsed = per_row({k: v[:sample] for k, v in fleet.items()}, times) * plants / sample
+            line += f' {elapsed:>9.2f}s {elapsed / vectorized:>8.0f}x'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
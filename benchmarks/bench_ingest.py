@@ -0,0 +1,101 @@
+"""Forecast ingestion throughput: per-row ORM adds vs. the bulk pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ingest --rows 50000
+    BENCH_POSTGRES_URL=postgresql://localhost/bench python -m benchmarks.bench_ingest
+
+SQLite runs against a throwaway file; PostgreSQL only runs when
+BENCH_POSTGRES_URL is set, and its tables are dropped and recreated.
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from models import db, GridSubstation, SubstationForecast
+from ingest import ingest_forecasts
+
+
+def make_app(url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    return app
+
+
+def feed_rows(substations, rows):
+    start = datetime(2030, 1, 1)
+    per_substation = -(-rows // substations)
+    for substation_id in range(1, substations + 1):
+        for slot in range(per_substation):
+            yield (substation_id, start + timedelta(minutes=15 * slot), 1.5, 2.5)
+
+
+def reset(substations):
+    db.drop_all()
+    db.create_all()
+    db.session.add_all(
+        GridSubstation(id=i, name=f'S{i}', code=f'S{i}', latitude=7.0, longitude=80.0, current_load=10.0)
+        for i in range(1, substations + 1)
+    )
+    db.session.commit()
+
+
+def bench_orm(rows):
+    started = time.perf_counter()
+    for substation_id, timestamp, generation, load in rows:
+        db.session.add(SubstationForecast(
+            substation_id=substation_id, timestamp=timestamp,
+            generation_forecast=generation, load_forecast=load
+        ))
+    db.session.commit()
+    return time.perf_counter() - started
+
+
+def bench_bulk(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['substation_id', 'timestamp', 'generation_forecast', 'load_forecast'])
+    for substation_id, timestamp, generation, load in rows:
+        writer.writerow([substation_id, timestamp.isoformat(), generation, load])
+    buffer.seek(0)
+    started = time.perf_counter()
+    ingest_forecasts(buffer, 'csv')
+    return time.perf_counter() - started
+
+
+def run(label, url, args):
+    rows = list(feed_rows(args.substations, args.rows))
+    with make_app(url).app_context():
+        for name, bench in (('orm', bench_orm), ('bulk', bench_bulk), ('bulk re-run', bench_bulk)):
+            if name != 'bulk re-run':
+                reset(args.substations)
+            elapsed = bench(rows)
+            print(f'{label:<10} {name:<12} {len(rows):>8} rows {elapsed:8.2f}s {len(rows) / elapsed:>12,.0f} rows/s')
+        db.session.remove()
+        db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--substations', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run('sqlite', 'sqlite:///' + os.path.join(tmp, 'bench.db'), args)
+    postgres_url = os.environ.get('BENCH_POSTGRES_URL')
+    if postgres_url:
+        run('postgresql', postgres_url, args)
+    else:
+        print('postgresql skipped (set BENCH_POSTGRES_URL to run it)')
+
+
+if __name__ == '__main__':
+    main()
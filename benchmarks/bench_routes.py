@@ -0,0 +1,327 @@
+"""Latency, SQL statements, response size and memory of every route, against a baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_routes
+    python -m benchmarks.bench_routes --save benchmarks/baseline.json
+    python -m benchmarks.bench_routes --compare benchmarks/baseline.json
+
+A throwaway SQLite database is filled with a synthetic fleet (see
+synthetic_data.py), then every route in app.py is requested in-process
+through the Flask test client: --requests times for p50/p95 latency,
+SQL statements per request and response size, then a few more times
+under tracemalloc for peak memory.  The read-only routes are then
+replayed from concurrent keep-alive clients against a local threaded
+server for their throughput.  The response cache is off unless --cache
+is given, so the numbers are those of a cold request.
+
+--save writes the results as a baseline; --compare exits with status 1
+when any route issues more SQL statements, returns a response or uses
+memory more than --tolerance above its baseline, or is slower or serves
+fewer requests per second by more than --latency-tolerance (twice that
+for p95).  A route of app.py without a scenario
+here is an error, so new routes have to be added.  Latency and
+throughput baselines only mean something on the machine that recorded
+them; statement counts, sizes and memory carry over.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import timedelta
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from benchmarks.load_test import percentile, run_load
+
+Scenario = namedtuple('Scenario', 'name endpoint method request expected_status')
+
+ROUNDS = 5
+MEMORY_REQUESTS = 3
+LATENCY_FLOOR_MS = 2.0  # differences below this are noise, whatever the ratio
+TAIL_LATENCY_FLOOR_MS = 5.0  # p95 of a few dozen requests also catches the odd GC pause
+SIZE_FLOOR_BYTES = 1024
+MEMORY_FLOOR_KB = 64.0
+
+
+def scenarios(db, start):
+    """One or more requests for every endpoint; ``request`` builds (path, test client kwargs)."""
+    from models import GridSubstation, SolarPlant
+
+    plant = SolarPlant.query.order_by(SolarPlant.id).first()
+    substation_id = plant.grid_substation_id
+    day = start.isoformat()
+    plant_form = {
+        'name': 'Benchmark Plant', 'size': '120', 'latitude': '7.1', 'longitude': '80.4', 'angle': '20',
+        'max_power': '100', 'owner_name': 'Benchmark', 'owner_account': 'BENCH', 'grid_substation': str(substation_id),
+        'connected_feeder': 'F-BENCH'
+    }
+    substation_form = {'name': 'Benchmark Substation', 'code': 'BENCH', 'latitude': '7.2', 'longitude': '80.5',
+                       'current_load': '25'}
+    feed = 'substation_id,timestamp,generation_forecast,load_forecast\n' + ''.join(
+        f'{substation_id},{(start + timedelta(minutes=15 * i)).isoformat()},1.5,{20 + i % 7}\n' for i in range(96)
+    )
+
+    def fresh(model, **columns):
+        # Rows for the delete routes, created outside the timed request.
+        row = model(**columns)
+        db.session.add(row)
+        db.session.commit()
+        return row.id
+
+    def fresh_plant():
+        return fresh(SolarPlant, name='Doomed Plant', size=1, latitude=7.0, longitude=80.0, angle=10, max_power=1,
+                     owner_name='Benchmark', owner_account='BENCH', grid_substation_id=substation_id,
+                     connected_feeder='F-BENCH')
+
+    def fresh_substation():
+        return fresh(GridSubstation, name='Doomed Substation', code='DOOM', latitude=7.0, longitude=80.0,
+                     current_load=1)
+
+    def get(path):
+        return lambda: (path, {})
+
+    return [
+        Scenario('GET /', 'index', 'GET', get('/'), 200),
+        Scenario('GET /plants', 'list_plants', 'GET', get('/plants'), 200),
+        Scenario('GET /plants sorted by size', 'list_plants', 'GET', get('/plants?sort=size&order=desc'), 200),
+        Scenario('GET /plants by substation', 'list_plants', 'GET', get(f'/plants?substation={substation_id}'), 200),
+        Scenario('GET /plant/add', 'add_plant', 'GET', get('/plant/add'), 200),
+        Scenario('POST /plant/add', 'add_plant', 'POST', lambda: ('/plant/add', {'data': plant_form}), 302),
+        Scenario('GET /plant/edit', 'edit_plant', 'GET', get(f'/plant/edit/{plant.id}'), 200),
+        Scenario('POST /plant/edit', 'edit_plant', 'POST', lambda: (f'/plant/edit/{plant.id}', {'data': plant_form}), 302),
+        Scenario('POST /plant/delete', 'delete_plant', 'POST', lambda: (f'/plant/delete/{fresh_plant()}', {}), 302),
+        Scenario('GET /substations', 'list_substations', 'GET', get('/substations'), 200),
+        Scenario('GET /substations?q=', 'list_substations', 'GET', get('/substations?q=synthetic%20substation%20001'),
+                 200),
+        Scenario('GET /substation/add', 'add_substation', 'GET', get('/substation/add'), 200),
+        Scenario('POST /substation/add', 'add_substation', 'POST',
+                 lambda: ('/substation/add', {'data': substation_form}), 302),
+        Scenario('GET /substation/edit', 'edit_substation', 'GET', get(f'/substation/edit/{substation_id}'), 200),
+        Scenario('POST /substation/edit', 'edit_substation', 'POST',
+                 lambda: (f'/substation/edit/{substation_id}',
+                          {'data': dict(substation_form, name='Synthetic Substation Edited')}), 302),
+        Scenario('POST /substation/delete', 'delete_substation', 'POST',
+                 lambda: (f'/substation/delete/{fresh_substation()}', {}), 302),
+        Scenario('GET /map', 'map_view', 'GET', get('/map'), 200),
+        Scenario('GET forecasts', 'substation_forecasts', 'GET',
+                 get(f'/api/substations/{substation_id}/forecasts?start={day}'), 200),
+        Scenario('GET forecasts hourly', 'substation_forecasts', 'GET',
+                 get(f'/api/substations/{substation_id}/forecasts?start={day}&bucket=hour'), 200),
+        Scenario('GET substation search', 'search_substations_api', 'GET',
+                 get('/api/substations/search?q=synthetic%20substation%2000'), 200),
+        Scenario('GET map points, country', 'map_points', 'GET', get('/api/map/points?bbox=5.9,79.6,9.8,81.9&zoom=8'),
+                 200),
+        Scenario('GET map points, street', 'map_points', 'GET',
+                 get('/api/map/points?bbox=6.85,79.8,6.95,79.95&zoom=14'), 200),
+        Scenario('GET nearby', 'map_nearby', 'GET', get('/api/map/nearby?lat=7.0&lng=80.5&limit=20'), 200),
+        Scenario('GET nearby within km', 'map_nearby', 'GET', get('/api/map/nearby?lat=7.0&lng=80.5&km=10'), 200),
+        Scenario('GET substation nearby', 'substation_nearby', 'GET',
+                 get(f'/api/substations/{substation_id}/nearby'), 200),
+        Scenario('GET summary', 'forecast_summary', 'GET', get(f'/api/summary?start={day}'), 200),
+        Scenario('GET scheduler status', 'scheduler_status', 'GET', get('/api/scheduler/status'), 200),
+        Scenario('POST forecasts bulk', 'bulk_forecasts', 'POST',
+                 lambda: ('/api/forecasts/bulk', {'data': feed, 'content_type': 'text/csv'}), 200),
+        Scenario('GET /metrics', 'metrics', 'GET', get('/metrics'), 200),
+    ]
+
+
+def check_coverage(app, cases):
+    missing = {rule.endpoint for rule in app.url_map.iter_rules()} - {'static'} - {case.endpoint for case in cases}
+    if missing:
+        sys.exit(f"No benchmark scenario for: {', '.join(sorted(missing))}")
+
+
+class StatementCounter:
+    def __init__(self, engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'after_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        self.count += 1
+
+
+def measure(app, db, cases, requests):
+    client = app.test_client(use_cookies=False)  # flashed messages would pile up in the session
+    counter = StatementCounter(db.engines.values())
+    results, failures = {}, []
+
+    def send(case, path, kwargs):
+        counter.count = 0
+        started = time.perf_counter()
+        response = client.open(path, method=case.method, **kwargs)
+        body = response.get_data()  # drains streamed responses inside the timing
+        elapsed = time.perf_counter() - started
+        if response.status_code != case.expected_status:
+            failures.append(f'{case.name}: HTTP {response.status_code}, expected {case.expected_status}')
+        return elapsed, counter.count, len(body)
+
+    for case in cases:
+        send(case, *case.request())  # warm-up: first-use template compilation and the like
+    # Interleave the routes over several rounds, so a burst of noise on the machine is spread over all of them.
+    samples = {case.name: [] for case in cases}
+    for _ in range(ROUNDS):
+        for case in cases:
+            gc.collect()
+            samples[case.name].extend(send(case, *case.request()) for _ in range(-(-requests // ROUNDS)))
+    for case in cases:
+        latencies = [elapsed for elapsed, _, _ in samples[case.name]]
+        results[case.name] = {
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'queries': max(queries for _, queries, _ in samples[case.name]),
+            'bytes': int(statistics.median(size for _, _, size in samples[case.name])),
+        }
+
+    # Without the cycle collector running mid-request the peak is the same from run to run.
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    for case in cases:
+        peaks = []
+        for _ in range(MEMORY_REQUESTS):
+            prepared = case.request()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            send(case, *prepared)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        results[case.name]['peak_kb'] = round(max(peaks) / 1024, 1)
+    tracemalloc.stop()
+    gc.enable()
+    return results, failures
+
+
+def measure_throughput(app, cases, results, concurrency, seconds):
+    """Requests per second of each read-only route on its own, from ``concurrency`` clients."""
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    errors = 0
+    try:
+        for case in cases:
+            if case.method != 'GET':
+                continue
+            path, _ = case.request()
+            latencies, failed = run_load(base_url, [path], concurrency, seconds)
+            results[case.name]['load_rps'] = round(len(latencies.get(path, ())) / seconds, 1)
+            errors += failed
+    finally:
+        server.shutdown()
+    return errors
+
+
+def report(results):
+    print(f"{'route':<32} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'bytes':>9} {'peak KB':>9} {'req/s':>8}")
+    for name, row in results.items():
+        load = row.get('load_rps')
+        print(f"{name:<32} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['queries']:>8} {row['bytes']:>9} "
+              f"{row['peak_kb']:>9.1f} {'' if load is None else f'{load:.1f}':>8}")
+
+
+def regressions(results, baseline, tolerance, latency_tolerance):
+    found = []
+    for name, row in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+
+        def grew(field, floor, tolerance=tolerance):
+            return row[field] > old[field] * (1 + tolerance) and row[field] - old[field] > floor
+
+        if grew('p50_ms', LATENCY_FLOOR_MS, latency_tolerance):
+            found.append(f"{name}: p50 {old['p50_ms']:.2f} -> {row['p50_ms']:.2f} ms")
+        if grew('p95_ms', TAIL_LATENCY_FLOOR_MS, 2 * latency_tolerance):
+            found.append(f"{name}: p95 {old['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+        if row['queries'] > old['queries']:
+            found.append(f"{name}: {old['queries']} -> {row['queries']} SQL statements")
+        if grew('bytes', SIZE_FLOOR_BYTES):
+            found.append(f"{name}: response {old['bytes']} -> {row['bytes']} bytes")
+        if grew('peak_kb', MEMORY_FLOOR_KB):
+            found.append(f"{name}: peak memory {old['peak_kb']} -> {row['peak_kb']} KB")
+        if 'load_rps' in row and 'load_rps' in old and row['load_rps'] * (1 + latency_tolerance) < old['load_rps']:
+            found.append(f"{name}: throughput {old['load_rps']} -> {row['load_rps']} req/s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--substations', type=int, default=200)
+    parser.add_argument('--plants', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--load-seconds', type=float, default=2.0, help='per read-only route; 0 skips the load run')
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='fail on regressions against a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative growth in size and memory')
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown in p50 and throughput; twice this for p95')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app reads its configuration at import time, so point it at the throwaway database first.
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        if not args.cache:
+            os.environ['CACHE_BACKEND'] = 'null'
+        os.environ.setdefault('SLOW_QUERY_SECONDS', '0')  # the slow-query log would drown the report under load
+        from app import app, db
+        from maintenance import upgrade_database
+        from rollups import today
+        from synthetic_data import generate_fleet
+
+        start = today()
+        with app.app_context():
+            upgrade_database()
+            generate_fleet(args.substations, args.plants, args.days, start=start)
+            cases = scenarios(db, start)
+            check_coverage(app, cases)
+            results, failures = measure(app, db, cases, args.requests)
+        errors = measure_throughput(app, cases, results, args.concurrency, args.load_seconds) \
+            if args.load_seconds else 0
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+    report(results)
+    if errors:
+        failures.append(f'{errors} failed requests under load')
+    document = {
+        'fleet': {'substations': args.substations, 'plants': args.plants, 'days': args.days, 'cache': args.cache},
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'routes': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(document, f, indent=2)
+            f.write('\n')
+        print(f'\nBaseline written to {args.save}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['fleet'] != document['fleet']:
+            failures.append(f"baseline fleet {baseline['fleet']} differs from this run's {document['fleet']}")
+        else:
+            failures.extend(regressions(results, baseline['routes'], args.tolerance, args.latency_tolerance))
+    if failures:
+        print('\nFAILED:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+    if args.compare:
+        print(f'\nNo regressions against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Throughput of the list and map routes under concurrent load.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --plants 20000 --concurrency 32 --duration 20
+    python -m benchmarks.load_test --url http://127.0.0.1:8000
+
+Without --url a throwaway SQLite database is filled with a synthetic
+fleet (see synthetic_data.py) and the app is served twice with gunicorn:
+the way the Procfile used to run it (``gunicorn app:app``, one sync
+worker) and with gunicorn.conf.py.  The same keep-alive load is replayed against both and
+the requests per second compared.  The cache is off (CACHE_BACKEND=null)
+unless --cache is given, so every request reaches the database.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+from benchmarks.bench_ingest import make_app
+from maintenance import upgrade_database
+from models import db
+from synthetic_data import generate_fleet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = (
+    '/plants',
+    '/plants?sort=size&order=desc',
+    '/substations',
+    '/map',
+    '/api/map/points?bbox=5.9,79.6,9.8,81.9&zoom=8',
+    '/api/map/points?bbox=6.85,79.8,6.95,79.95&zoom=14',
+)
+SERVERS = (
+    ('gunicorn defaults', []),
+    ('gunicorn.conf.py', ['-c', 'gunicorn.conf.py']),
+)
+
+
+def seed(url, substations, plants):
+    with make_app(url).app_context():
+        upgrade_database()
+        generate_fleet(substations, plants, days=0)
+        db.engine.dispose()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    parts = urllib.parse.urlsplit(base_url)
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            conn.request('GET', '/plants')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f'server at {base_url} did not come up within {timeout}s')
+
+
+def start_server(args, env):
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *args, '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        _wait_until_up(base_url, process)
+    except Exception:
+        process.kill()
+        raise
+    return process, base_url
+
+
+def run_load(base_url, paths, concurrency, duration):
+    """Replay ``paths`` round-robin from ``concurrency`` keep-alive clients for ``duration`` seconds.
+
+    Returns {path: [latency seconds, ...]} and the number of failed requests.
+    """
+    parts = urllib.parse.urlsplit(base_url)
+    latencies = defaultdict(list)
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        mine, failed = defaultdict(list), 0
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+                ok = False
+            if ok:
+                mine[path].append(time.perf_counter() - started)
+            else:
+                failed += 1
+        conn.close()
+        with lock:
+            for path, values in mine.items():
+                latencies[path].extend(values)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float('nan')
+
+
+def report(label, latencies, errors, duration):
+    total = sum(len(values) for values in latencies.values())
+    print(f'\n{label}: {total / duration:,.1f} req/s, {errors} errors')
+    print(f"  {'route':<55} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for path, values in latencies.items():
+        print(f'  {path:<55} {len(values) / duration:>8.1f} '
+              f'{percentile(values, 0.5) * 1000:>8.1f} {percentile(values, 0.95) * 1000:>8.1f}')
+    return total / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='load an already running server instead of starting gunicorn')
+    parser.add_argument('--plants', type=int, default=5000)
+    parser.add_argument('--substations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per server')
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on')
+    args = parser.parse_args()
+
+    if args.url:
+        report(args.url, *run_load(args.url, PATHS, args.concurrency, args.duration), args.duration)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'load.db')
+        seed(url, args.substations, args.plants)
+        env = dict(os.environ, DATABASE_URL=url)
+        if not args.cache:
+            env['CACHE_BACKEND'] = 'null'
+        throughput = {}
+        for label, server_args in SERVERS:
+            process, base_url = start_server(server_args, env)
+            try:
+                latencies, errors = run_load(base_url, PATHS, args.concurrency, args.duration)
+            finally:
+                process.terminate()
+                process.wait()
+            throughput[label] = report(label, latencies, errors, args.duration)
+        (baseline, _), (tuned, _) = SERVERS
+        print(f'\n{tuned} serves {throughput[tuned] / throughput[baseline]:.1f}x the requests of {baseline}')
+
+
+if __name__ == '__main__':
+    main()
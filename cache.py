@@ -0,0 +1,207 @@
+"""Cache for rendered fragments and query results.
+
+Entries are grouped under tags ('plants', 'substations', ...).  Every tag
+has a version stored in the backend itself and cache keys embed the
+current versions of their tags, so invalidating a tag is a single write
+that orphans every entry built from it; orphaned entries age out through
+the TTL or the size bound.  Because the versions live in the backend, the
+shared SQLite backend invalidates across all gunicorn workers at once.
+
+Configuration (app.config / environment):
+
+    CACHE_BACKEND      'memory' (default), 'sqlite' or 'null'
+    CACHE_PATH         SQLite file for the shared backend (default: cache.db
+                       in the app's instance folder)
+    CACHE_MAX_ENTRIES  size bound per backend (default 1024)
+    CACHE_DEFAULT_TTL  seconds, 0 for no expiry (default 300)
+    APP_VERSION        deploy identifier (default: a hash of the app's
+                       Python files, templates and static files)
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+
+from config import primary
+
+
+class NullBackend:
+    """Never stores anything; useful to switch caching off."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUBackend:
+    """Size-bounded in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Cache shared by every process on the host through one SQLite file."""
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        # A throwaway connection, so nothing is inherited by processes forked after start-up.
+        with closing(sqlite3.connect(self.path, timeout=5, isolation_level=None)) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL, stored_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_stored_at ON cache (stored_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value), now + ttl if ttl else None, now)
+        )
+        conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+        # Tag versions are the oldest rows; evicting one would orphan every entry built from that tag.
+        conn.execute(
+            'DELETE FROM cache WHERE key IN '
+            "(SELECT key FROM cache WHERE key NOT LIKE 'tag:%' ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+
+def source_version(app):
+    """Hash of the code and templates the app serves, the same in every worker of a deploy."""
+    digest = hashlib.sha1()
+    paths = [os.path.join(app.root_path, name) for name in os.listdir(app.root_path) if name.endswith('.py')]
+    for folder in (app.template_folder, app.static_folder):
+        folder = os.path.join(app.root_path, folder) if folder else None
+        if folder and os.path.isdir(folder):
+            paths.extend(os.path.join(root, name) for root, _, names in os.walk(folder) for name in names)
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, app.root_path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class Cache:
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.default_ttl = 300
+        self.version = ''
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        backend = config.get('CACHE_BACKEND', os.environ.get('CACHE_BACKEND', 'memory'))
+        max_entries = int(config.get('CACHE_MAX_ENTRIES', os.environ.get('CACHE_MAX_ENTRIES', 1024)))
+        self.default_ttl = int(config.get('CACHE_DEFAULT_TTL', os.environ.get('CACHE_DEFAULT_TTL', 300)))
+        self.version = config.get('APP_VERSION', os.environ.get('APP_VERSION')) or source_version(app)
+        if backend == 'memory':
+            self.backend = LRUBackend(max_entries)
+        elif backend == 'sqlite':
+            path = config.get('CACHE_PATH', os.environ.get('CACHE_PATH'))
+            if path is None:
+                # Entries are unpickled, so the file must not live anywhere other users can write to.
+                os.makedirs(app.instance_path, mode=0o700, exist_ok=True)
+                path = os.path.join(app.instance_path, 'cache.db')
+            self.backend = SQLiteBackend(path, max_entries)
+        elif backend == 'null':
+            self.backend = NullBackend()
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND {backend!r}')
+        app.extensions['cache'] = self
+
+    def _version(self, tag):
+        version = self.backend.get('tag:' + tag)
+        if version is None:
+            version = uuid.uuid4().hex
+            self.backend.set('tag:' + tag, version, 0)
+        return version
+
+    def key(self, name, tags, *parts):
+        """Cache key for ``name`` that changes whenever one of ``tags`` is invalidated or the app is redeployed."""
+        versions = ','.join(f'{tag}={self._version(tag)}' for tag in sorted(tags))
+        return '|'.join([name, self.version, versions] + [str(part) for part in parts])
+
+    def etag(self, key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_or_set(self, key, builder, ttl=None):
+        value = self.backend.get(key)
+        if value is None:
+            # A lagging replica could store stale data under a fresh tag version, so fill from the primary.
+            with primary():
+                value = builder()
+            self.backend.set(key, value, self.default_ttl if ttl is None else ttl)
+        return value
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            # A fresh random version rather than an increment, so concurrent workers can't collide.
+            self.backend.set('tag:' + tag, uuid.uuid4().hex, 0)
+
+    def clear(self):
+        self.backend.clear()
+
+
+cache = Cache()
@@ -0,0 +1,139 @@
+"""Database engine, connection pool and read-replica configuration.
+
+configure_database() fills in the Flask-SQLAlchemy settings before
+db.init_app(); configure_engines() then tunes the engines it created.  Everything
+is read from the environment:
+
+    DATABASE_URL            primary database (default: local SQLite file)
+    DATABASE_REPLICA_URL    optional read replica for @read_replica views
+    DB_POOL_SIZE            connections kept per process (default: GUNICORN_THREADS or 5)
+    DB_MAX_OVERFLOW         extra connections allowed under bursts (default 10)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (default 10)
+    DB_POOL_RECYCLE         seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING        '0' to skip the liveness check on checkout
+    DB_STATEMENT_TIMEOUT_MS PostgreSQL statement_timeout (default none; gunicorn.conf.py
+                            sets 30000 for web workers)
+    SQLITE_BUSY_TIMEOUT_MS  how long SQLite waits on a locked database (default 5000)
+
+The SQLite fallback runs in WAL mode so readers in other gunicorn
+workers are not blocked by a writer.
+"""
+import os
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = 'replica'
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def database_url(name='DATABASE_URL', default='sqlite:///solar_plants.db'):
+    url = os.environ.get(name)
+    if url and url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url or default
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``url``."""
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+    }
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        # Flask-SQLAlchemy picks the pool for SQLite itself; only the lock wait is ours to set.
+        options['connect_args'] = {'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}
+        return options
+    options.update(
+        pool_size=_env_int('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 5)),
+        max_overflow=_env_int('DB_MAX_OVERFLOW', 10),
+        pool_timeout=_env_int('DB_POOL_TIMEOUT', 10),
+    )
+    # Off unless set: CLI commands and the scheduler run statements that legitimately take minutes.
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if backend == 'postgresql' and statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+def configure_database(app):
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        replica_url = database_url('DATABASE_REPLICA_URL')
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: {'url': replica_url, **engine_options(replica_url)}}
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')  # with WAL, only a power loss can drop the last commits
+    cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}")
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-20000')  # 20 MB page cache per connection
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
+
+
+def configure_engines(app, db):
+    """Apply SQLite pragmas to the engines and route @read_replica views to the replica."""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _sqlite_pragmas)
+        has_replica = REPLICA_BIND in db.engines
+    if has_replica:
+        @app.before_request
+        def use_read_replica():
+            view = app.view_functions.get(request.endpoint)
+            g.read_replica = getattr(view, 'read_replica', False)
+
+
+def read_replica(view):
+    """Mark a view that only reads, so it may be served from DATABASE_REPLICA_URL.
+
+    Values the view puts in the response cache are still built from the
+    primary (see Cache.get_or_set), so replica lag never outlives a request.
+    """
+    view.read_replica = True
+    return view
+
+
+@contextmanager
+def primary():
+    """Send the queries of the block to the primary even inside a @read_replica view."""
+    if not has_app_context() or not g.get('read_replica'):
+        yield
+        return
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = True
+
+
+def dispose_engines(app, db):
+    """Drop connections inherited from a parent process, e.g. after a gunicorn fork."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+class RoutingSession(Session):
+    """Session that sends the queries of @read_replica views to the replica bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('read_replica'):
+            engines = current_app.extensions['sqlalchemy'].engines
+            if REPLICA_BIND in engines:
+                return engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -1,4 +1,7 @@
-from app import app, db, GridSubstation, SubstationForecast
+from app import app, db, GridSubstation
+from ingest import upsert_forecasts
+from forecasting import refresh_generation_forecasts
+from cache import cache
 from datetime import datetime, timedelta
 import random
 import math
@@ -21,33 +24,34 @@ def create_sample_data():
         db.session.commit()
 
         # Now, let's create forecast data for each substation
-        start_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+        start_time = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
         end_time = start_time + timedelta(days=3)
         
+        forecasts = []
         for substation in GridSubstation.query.all():
             current_time = start_time
             base_load = substation.current_load
-            base_generation = base_load * 0.8  # Assume generation is about 80% of load on average
 
             while current_time < end_time:
                 # Create some variation in the forecasts
                 time_factor = 1 + 0.3 * math.sin(current_time.hour / 12 * math.pi)  # Daily cycle
                 random_factor = random.uniform(0.9, 1.1)  # Random variation
 
-                generation_forecast = base_generation * time_factor * random_factor
                 load_forecast = base_load * time_factor * random_factor * 1.1  # Load slightly higher than generation
 
-                forecast = SubstationForecast(
-                    substation_id=substation.id,
-                    timestamp=current_time,
-                    generation_forecast=round(generation_forecast, 2),
-                    load_forecast=round(load_forecast, 2)
-                )
-                db.session.add(forecast)
+                forecasts.append({
+                    'substation_id': substation.id,
+                    'timestamp': current_time,
+                    'load_forecast': round(load_forecast, 2)
+                })
 
                 current_time += timedelta(minutes=15)
 
+        upsert_forecasts(forecasts, value_fields=('load_forecast',))
+        # Generation comes from the clear-sky model for the plants connected to each substation.
+        refresh_generation_forecasts(start_time, days=3)
         db.session.commit()
+        cache.invalidate('forecasts')
         print("Sample data created successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""Clear-sky solar generation forecasts for the whole fleet.
+
+Every plant is evaluated on a common time grid with NumPy: solar position,
+Haurwitz clear-sky irradiance, plane-of-array irradiance on an
+equator-facing panel tilted at the plant's ``angle``, conversion to AC
+output using the plant's ``size`` and clipping at ``max_power``.  Plants
+are processed in chunks of whole arrays (never one row at a time) and
+summed per grid substation into the MW figures stored in
+``SubstationForecast.generation_forecast``.
+
+Timestamps are naive UTC, like the rest of the app.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from models import db, GridSubstation, SolarPlant
+from ingest import upsert_forecasts
+
+STEP_MINUTES = 15
+PERFORMANCE_RATIO = 0.8  # inverter, wiring, soiling and temperature losses
+DIFFUSE_FRACTION = 0.15  # typical share of diffuse light in clear-sky GHI
+ALBEDO = 0.2
+CHUNK_SIZE = 5000  # plants per batch; bounds memory at CHUNK_SIZE x time steps
+
+
+def forecast_times(start, days=3, step_minutes=STEP_MINUTES, end=None):
+    """The forecast grid: every ``step_minutes`` from ``start`` for ``days`` days or until ``end``."""
+    if end is not None:
+        steps = int((end - start).total_seconds() // (step_minutes * 60))
+    else:
+        steps = days * 24 * 60 // step_minutes
+    return np.datetime64(start, 'm') + np.arange(steps) * np.timedelta64(step_minutes, 'm')
+
+
+def _solar_geometry(times):
+    # Per time step: declination, and the UTC hour plus equation of time (in hours).
+    day_of_year = (times.astype('datetime64[D]') - times.astype('datetime64[Y]')).astype(np.float64) + 1
+    utc_hours = (times - times.astype('datetime64[D]')).astype('timedelta64[m]').astype(np.float64) / 60
+    b = 2 * np.pi * (day_of_year - 81) / 364
+    equation_of_time = (9.87 * np.sin(2 * b) - 7.53 * np.cos(b) - 1.5 * np.sin(b)) / 60
+    declination = np.radians(23.45) * np.sin(2 * np.pi * (284 + day_of_year) / 365)
+    return declination, utc_hours + equation_of_time
+
+
+def plant_output_kw(latitude, longitude, size, angle, max_power, times):
+    """Clear-sky AC output in kW, shape (plants, times).
+
+    All plant arguments are 1-D arrays of equal length; ``times`` comes
+    from forecast_times().
+    """
+    declination, hours = _solar_geometry(times)
+    phi = np.radians(latitude)[:, None]
+    tilt = np.radians(angle)[:, None]
+    hour_angle = np.radians(15 * (hours[None, :] + longitude[:, None] / 15 - 12))
+    sin_dec, cos_dec = np.sin(declination)[None, :], np.cos(declination)[None, :]
+    cos_hour_angle = np.cos(hour_angle)
+
+    cos_zenith = np.sin(phi) * sin_dec + np.cos(phi) * cos_dec * cos_hour_angle
+    daylight = cos_zenith > 0.01
+    cos_zenith = np.where(daylight, cos_zenith, 1.0)
+    ghi = np.where(daylight, 1098 * cos_zenith * np.exp(-0.059 / cos_zenith), 0.0)
+    dhi = DIFFUSE_FRACTION * ghi
+    dni = (ghi - dhi) / cos_zenith
+
+    # An equator-facing panel tilted by beta sees the sun as a flat panel at latitude phi -/+ beta would.
+    tilted_phi = phi - np.sign(phi) * tilt
+    cos_incidence = np.sin(tilted_phi) * sin_dec + np.cos(tilted_phi) * cos_dec * cos_hour_angle
+    poa = (dni * np.clip(cos_incidence, 0, None)
+           + dhi * (1 + np.cos(tilt)) / 2
+           + ghi * ALBEDO * (1 - np.cos(tilt)) / 2)
+
+    output = size[:, None] * poa / 1000 * PERFORMANCE_RATIO
+    return np.minimum(output, max_power[:, None])
+
+
+def substation_generation_mw(fleet, times, substation_ids=None, chunk_size=CHUNK_SIZE):
+    """Total clear-sky generation per substation in MW.
+
+    ``fleet`` maps 'grid_substation_id', 'latitude', 'longitude', 'size',
+    'angle' and 'max_power' to equal-length arrays.  ``substation_ids``
+    defaults to the substations that have plants; listed substations
+    without any get all-zero rows.  Returns (substation ids, array of
+    shape (substations, times)).
+    """
+    order = np.argsort(fleet['grid_substation_id'], kind='stable')
+    fleet = {name: np.asarray(values)[order] for name, values in fleet.items()}
+    if substation_ids is None:
+        substation_ids = fleet['grid_substation_id']
+    substation_ids = np.unique(np.asarray(substation_ids, dtype=np.int64))
+    totals = np.zeros((len(substation_ids), len(times)))
+    for start in range(0, len(order), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        output = plant_output_kw(fleet['latitude'][chunk], fleet['longitude'][chunk], fleet['size'][chunk],
+                                 fleet['angle'][chunk], fleet['max_power'][chunk], times)
+        # Plants are sorted by substation, so each substation is one contiguous run of rows.
+        chunk_ids = fleet['grid_substation_id'][chunk]
+        run_ids, run_starts = np.unique(chunk_ids, return_index=True)
+        totals[np.searchsorted(substation_ids, run_ids)] += np.add.reduceat(output, run_starts, axis=0)
+    return substation_ids, totals / 1000
+
+
+def load_fleet(substation_ids=None):
+    """Plant columns needed by the engine as arrays, read in one query."""
+    query = db.session.query(
+        SolarPlant.grid_substation_id, SolarPlant.latitude, SolarPlant.longitude,
+        SolarPlant.size, SolarPlant.angle, SolarPlant.max_power
+    )
+    if substation_ids is not None:
+        query = query.filter(SolarPlant.grid_substation_id.in_(substation_ids))
+    rows = query.all()
+    columns = ('grid_substation_id', 'latitude', 'longitude', 'size', 'angle', 'max_power')
+    if not rows:
+        return {name: np.array([], dtype=np.int64 if name == 'grid_substation_id' else np.float64)
+                for name in columns}
+    values = list(zip(*rows))
+    return {name: np.array(values[i], dtype=np.int64 if i == 0 else np.float64)
+            for i, name in enumerate(columns)}
+
+
+def generation_rows(substation_ids, generation, times):
+    """Forecast rows for upsert_forecasts() from substation_generation_mw() output."""
+    timestamps = times.astype('datetime64[us]').astype(datetime)
+    for substation_id, series in zip(substation_ids.tolist(), np.round(generation, 4).tolist()):
+        for timestamp, value in zip(timestamps, series):
+            yield {'substation_id': substation_id, 'timestamp': timestamp, 'generation_forecast': value}
+
+
+def refresh_generation_forecasts(start=None, days=3, substation_ids=None):
+    """Recompute and upsert generation forecasts for ``substation_ids`` (default: all).
+
+    Only the generation column is written; load forecasts are left as they
+    are.  Returns the number of forecast rows written.  Does not commit.
+    """
+    if start is None:
+        start = datetime.utcnow().replace(second=0, microsecond=0)
+        start -= timedelta(minutes=start.minute % STEP_MINUTES)
+    fleet = load_fleet(substation_ids)
+    if substation_ids is None:
+        substation_ids = [sub_id for sub_id, in db.session.query(GridSubstation.id)]
+    times = forecast_times(start, days)
+    ids, generation = substation_generation_mw(fleet, times, substation_ids)
+    return upsert_forecasts(generation_rows(ids, generation, times), value_fields=('generation_forecast',))
@@ -0,0 +1,40 @@
+"""gunicorn settings: ``gunicorn -c gunicorn.conf.py app:app``.
+
+One worker process per CPU core, each with GUNICORN_THREADS threads so a
+worker keeps serving while its requests wait on the database.  The app is
+imported once in the master (preload_app) and forked, which saves memory
+and start-up time; every worker then drops the database connections it
+inherited and opens its own.  Unless CACHE_BACKEND says otherwise, more
+than one worker shares the response cache through SQLite (see cache.py),
+and PostgreSQL cancels statements that outlast the worker timeout.
+Heroku-style WEB_CONCURRENCY and PORT are honoured.
+"""
+import multiprocessing
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+
+# Cache invalidations have to reach every worker, so with more than one the cache lives in a shared SQLite file.
+if workers > 1:
+    os.environ.setdefault('CACHE_BACKEND', 'sqlite')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Only web workers get a statement timeout; maintenance commands and the scheduler run without one.
+os.environ.setdefault('DB_STATEMENT_TIMEOUT_MS', str(timeout * 1000))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so slow leaks can't build up; the jitter keeps them from restarting together.
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from app import app
+    from models import db
+    from config import dispose_engines
+    dispose_engines(app, db)
@@ -0,0 +1,252 @@
+"""Bulk forecast ingestion.
+
+Forecast feeds arrive as CSV or JSON Lines streams.  Records are validated
+in chunks and written with a single multi-row upsert per chunk (COPY into a
+staging table on PostgreSQL), so re-running a feed updates rows in place
+instead of duplicating them.
+"""
+import csv
+import io
+import json
+import math
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, GridSubstation, SubstationForecast
+from rollups import refresh_rollups_for_rows
+from cache import cache
+
+KEY_FIELDS = ('substation_id', 'timestamp')
+VALUE_FIELDS = ('generation_forecast', 'load_forecast')
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class IngestError(ValueError):
+    """A record in the feed could not be ingested.
+
+    ``line`` is the 1-based line of the offending record and ``rows`` the
+    number of rows already committed from earlier chunks.
+    """
+
+    def __init__(self, message, line=None, rows=0):
+        super().__init__(message)
+        self.line = line
+        self.rows = rows
+
+
+def _read_csv(stream):
+    reader = csv.DictReader(stream)
+    try:
+        # Line 1 is the header, so the first record is on line 2.
+        for line, record in enumerate(reader, start=2):
+            # DictReader files values beyond the header under None and pads short rows with None.
+            if None in record:
+                raise IngestError('More fields than the header', line)
+            if None in record.values():
+                raise IngestError('Fewer fields than the header', line)
+            yield line, record
+    except csv.Error as e:
+        raise IngestError(f'Invalid CSV: {e}', reader.line_num)
+
+
+def _read_jsonl(stream):
+    for line, raw in enumerate(stream, start=1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise IngestError(f'Invalid JSON: {e.msg}', line)
+        if not isinstance(record, dict):
+            raise IngestError('Expected a JSON object', line)
+        yield line, record
+
+
+READERS = {'csv': _read_csv, 'jsonl': _read_jsonl}
+
+
+def _read(stream, fmt):
+    try:
+        yield from READERS[fmt](stream)
+    except UnicodeDecodeError as e:
+        raise IngestError(f'Invalid UTF-8: {e.reason} at byte {e.start}')
+
+
+def _parse_float(value):
+    if value is None or value == '':
+        return None
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f'Expected a finite number, got {value}')
+    return value
+
+
+def _parse_id(value):
+    # int('1.7') fails but int(1.7) and int(True) don't, so only real integers and digit strings get through.
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+        return int(value)
+    raise ValueError(f'Expected an integer substation_id, got {value!r}')
+
+
+def _parse_timestamp(value):
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        # Forecast timestamps are stored as naive UTC.
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _validate(record, line, value_fields, substation_ids):
+    missing = [field for field in KEY_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise IngestError(f"Missing {', '.join(missing)}", line)
+    extra = set(record) - set(KEY_FIELDS) - set(value_fields)
+    if extra:
+        raise IngestError(f"Unexpected fields {', '.join(sorted(extra))}", line)
+    # Every record must carry the first record's fields, or the upsert would overwrite a left-out one with NULL.
+    absent = [field for field in value_fields if field not in record]
+    if absent:
+        raise IngestError(f"Missing {', '.join(absent)}", line)
+    try:
+        row = {
+            'substation_id': _parse_id(record['substation_id']),
+            'timestamp': _parse_timestamp(record['timestamp']),
+        }
+        for field in value_fields:
+            row[field] = _parse_float(record[field])
+    except (TypeError, ValueError) as e:
+        raise IngestError(str(e), line)
+    if row['substation_id'] not in substation_ids:
+        raise IngestError(f"Unknown substation_id {row['substation_id']}", line)
+    return row
+
+
+def _value_fields(record):
+    fields = tuple(field for field in VALUE_FIELDS if field in record)
+    if not fields:
+        raise IngestError(f"Expected at least one of {', '.join(VALUE_FIELDS)}")
+    return fields
+
+
+def _upsert_statement(dialect_insert, value_fields):
+    stmt = dialect_insert(SubstationForecast.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=list(KEY_FIELDS),
+        set_={field: stmt.excluded[field] for field in value_fields},
+    )
+
+
+def _copy_upsert(rows, value_fields):
+    # COPY the chunk into a session-local staging table, then upsert from it in one statement.
+    columns = KEY_FIELDS + value_fields
+    column_list = ', '.join(columns)
+    connection = db.session.connection()
+    connection.execute(text(
+        'CREATE TEMPORARY TABLE IF NOT EXISTS substation_forecast_stage '
+        '(substation_id integer, timestamp timestamp, '
+        'generation_forecast double precision, load_forecast double precision) '
+        'ON COMMIT DELETE ROWS'
+    ))
+    # Rows staged by an earlier call in the same transaction would otherwise be upserted again.
+    connection.execute(text('TRUNCATE substation_forecast_stage'))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY substation_forecast_stage ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+    finally:
+        cursor.close()
+    updates = ', '.join(f'{field} = EXCLUDED.{field}' for field in value_fields)
+    connection.execute(text(
+        f'INSERT INTO substation_forecast ({column_list}) '
+        f'SELECT {column_list} FROM substation_forecast_stage '
+        f'ON CONFLICT (substation_id, timestamp) DO UPDATE SET {updates}'
+    ))
+
+
+def upsert_forecasts(rows, value_fields=VALUE_FIELDS, use_copy=True):
+    """Insert or update forecast rows keyed on (substation_id, timestamp).
+
+    ``rows`` are dicts with the key fields and ``value_fields``; only those
+    value columns are overwritten on conflict.  The hourly and daily
+    rollups covering the rows are refreshed in the same transaction.
+    Does not commit.  Returns the number of rows written.
+    """
+    # A single upsert statement may not touch the same key twice, so the last value wins.
+    rows = list({(row['substation_id'], row['timestamp']): row for row in rows}.values())
+    if not rows:
+        return 0
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql' and use_copy:
+        _copy_upsert(rows, value_fields)
+    elif dialect == 'postgresql':
+        db.session.execute(_upsert_statement(postgresql.insert, value_fields), rows)
+    elif dialect == 'sqlite':
+        db.session.execute(_upsert_statement(sqlite.insert, value_fields), rows)
+    else:
+        raise NotImplementedError(f'Forecast upserts are not supported on {dialect}')
+    refresh_rollups_for_rows(rows)
+    return len(rows)
+
+
+def ingest_forecasts(stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Validate and upsert every record from a text ``stream`` in ``fmt``.
+
+    The value fields of the first record are the ones written, and every
+    later record must have exactly those.  Timestamps with a UTC offset
+    are stored as naive UTC.  Each chunk is committed as soon as it is
+    written, so a bad record leaves the earlier chunks in place; feeds are
+    idempotent and can simply be re-run once fixed.  Returns the number of
+    rows written.
+    """
+    if fmt not in READERS:
+        raise IngestError(f"Unknown format {fmt!r}: expected one of {', '.join(FORMATS)}")
+    substation_ids = {sub_id for sub_id, in db.session.query(GridSubstation.id)}
+    value_fields = None
+    total = 0
+    chunk = []
+    try:
+        for line, record in _read(stream, fmt):
+            if value_fields is None:
+                value_fields = _value_fields(record)
+            chunk.append(_validate(record, line, value_fields, substation_ids))
+            if len(chunk) >= chunk_size:
+                total += upsert_forecasts(chunk, value_fields)
+                db.session.commit()
+                cache.invalidate('forecasts')
+                chunk = []
+        if chunk:
+            total += upsert_forecasts(chunk, value_fields)
+            db.session.commit()
+            cache.invalidate('forecasts')
+    except IngestError as e:
+        db.session.rollback()
+        e.rows = total
+        raise
+    return total
+
+
+def format_for(filename, content_type=None):
+    """Guess the feed format from a file name or a request content type."""
+    if content_type:
+        content_type = content_type.split(';')[0].strip()
+        if content_type in ('text/csv', 'application/csv'):
+            return 'csv'
+        if content_type in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+            return 'jsonl'
+    if filename and filename.endswith('.csv'):
+        return 'csv'
+    if filename and filename.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
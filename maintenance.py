@@ -0,0 +1,116 @@
+"""Schema upgrades and housekeeping for an existing database.
+
+These are run from the ``flask`` CLI (see app.py) and never on a request.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateColumn, CreateIndex, DropIndex
+
+from models import (db, GridSubstation, SolarPlant, SubstationForecast, SubstationForecastArchive,
+                    SubstationForecastHourly)
+from spatial import grid_cell
+from rollups import rebuild_rollups
+
+
+def _dedupe_forecasts(model=SubstationForecast):
+    # Keep the newest row for each (substation, timestamp) so the unique index can be built.
+    keep = select(func.max(model.id)).group_by(model.substation_id, model.timestamp)
+    result = db.session.execute(delete(model).where(model.id.not_in(keep)))
+    return result.rowcount
+
+
+def _archive_id_sequence():
+    # Archives made before it had its own ids have no id default on PostgreSQL; SQLite assigns rowids anyway.
+    if db.engine.dialect.name != 'postgresql':
+        return
+    table = SubstationForecastArchive.__tablename__
+    id_column = next(c for c in inspect(db.engine).get_columns(table) if c['name'] == 'id')
+    if id_column['default'] is not None:
+        return
+    db.session.execute(text(f'CREATE SEQUENCE IF NOT EXISTS {table}_id_seq OWNED BY {table}.id'))
+    db.session.execute(text(f"SELECT setval('{table}_id_seq', COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)"))
+    db.session.execute(text(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')"))
+
+
+def _add_missing_columns():
+    # create_all() never alters existing tables; new columns are all nullable, so ADD COLUMN suffices.
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+
+
+def _backfill_grid_cells():
+    for model in (GridSubstation, SolarPlant):
+        rows = db.session.query(model.id, model.latitude, model.longitude).filter(model.grid_cell.is_(None))
+        updates = [{'id': id_, 'grid_cell': grid_cell(lat, lon)} for id_, lat, lon in rows]
+        if updates:
+            db.session.execute(update(model), updates)
+
+
+def _drop_indexes_now_unique(connection):
+    # An index that became unique keeps its name, so IF NOT EXISTS below would leave the old one in place.
+    inspector = inspect(connection)
+    for table in db.metadata.sorted_tables:
+        if not any(index.unique for index in table.indexes):
+            continue  # also keeps reflection away from the expression indexes it can't read
+        existing = {index['name']: index for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.unique and index.name in existing and not existing[index.name]['unique']:
+                connection.execute(DropIndex(index))
+
+
+def upgrade_database():
+    """Bring an existing database up to the current schema.
+
+    Creates missing tables and columns, removes duplicate forecast rows,
+    fills in derived columns and empty rollups and then creates any
+    indexes declared on the models that the database doesn't have yet.
+    Safe to run repeatedly.  Returns the number of duplicates removed.
+    """
+    db.create_all()
+    _add_missing_columns()
+    removed = _dedupe_forecasts()
+    _dedupe_forecasts(SubstationForecastArchive)
+    _archive_id_sequence()
+    _backfill_grid_cells()
+    if db.session.query(SubstationForecastHourly.substation_id).first() is None:
+        rebuild_rollups()
+    db.session.commit()
+    # IF NOT EXISTS rather than checkfirst: reflection can't see expression indexes such as lower(name).
+    with db.engine.begin() as connection:
+        _drop_indexes_now_unique(connection)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+    return removed
+
+
+def archive_forecasts(older_than_days, now=None):
+    """Move forecasts older than ``older_than_days`` into the archive table.
+
+    Keeps the hot ``substation_forecast`` table bounded to recent history so
+    range scans on the (substation_id, timestamp) index stay short.
+    Returns the number of rows moved.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    columns = ('substation_id', 'timestamp', 'generation_forecast', 'load_forecast')
+    old_rows = select(*(getattr(SubstationForecast, c) for c in columns)).where(SubstationForecast.timestamp < cutoff)
+    dialect = db.session.get_bind().dialect.name
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(dialect)
+    if dialect_insert is None:
+        raise NotImplementedError(f'Archiving forecasts is not supported on {dialect}')
+    # A slot archived before and later re-ingested replaces its archived values.
+    stmt = dialect_insert(SubstationForecastArchive.__table__).from_select(columns, old_rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['substation_id', 'timestamp'],
+        set_={c: stmt.excluded[c] for c in ('generation_forecast', 'load_forecast')},
+    ))
+    result = db.session.execute(delete(SubstationForecast).where(SubstationForecast.timestamp < cutoff))
+    db.session.commit()
+    return result.rowcount
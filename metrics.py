@@ -0,0 +1,240 @@
+"""Request, SQL and template instrumentation exposed in Prometheus format.
+
+Metrics.init_app() hooks into the Flask request cycle, the template
+signals and the SQLAlchemy engine events and records, per endpoint:
+
+    http_request_duration_seconds     request latency
+    http_request_db_queries           SQL statements executed per request
+    http_request_db_duration_seconds  time spent in those statements
+    template_render_duration_seconds  render time, per template
+    db_slow_queries_total             statements slower than SLOW_QUERY_SECONDS
+
+The registry lives in the process, so under gunicorn each worker reports
+its own series; scrape them per worker or put a single worker behind
+/metrics.  Statements slower than SLOW_QUERY_SECONDS are logged with
+their query plan.  With PROFILER_ENABLED (default: debug mode only),
+adding ``?profile=1`` to any URL returns a cProfile report instead of
+the page.
+
+Configuration (app.config / environment):
+
+    SLOW_QUERY_SECONDS  default 0.25; 0 disables slow-query logging
+    PROFILER_ENABLED    '1' to allow ?profile=1 outside debug mode
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * len(self.buckets), 0.0, 0])
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, _, _ = series = self._series[labels]
+            index = bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                label_text = _labels(self.label_names, labels)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, labels):
+        with self._lock:
+            self._values[labels] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}_total{{{_labels(self.label_names, labels)}}} {value}')
+        return lines
+
+
+def _labels(names, values):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency.', ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram(
+            'http_request_db_queries', 'SQL statements per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_db_duration = Histogram(
+            'http_request_db_duration_seconds', 'Time spent in SQL per request.', ('endpoint',))
+        self.template_duration = Histogram(
+            'template_render_duration_seconds', 'Template render time.', ('template',))
+        self.slow_queries = Counter(
+            'db_slow_queries', 'Statements slower than SLOW_QUERY_SECONDS.', ('endpoint',))
+        self.slow_query_seconds = 0.25
+        self.profiler_enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, db=None):
+        config = app.config
+        self.slow_query_seconds = float(config.get(
+            'SLOW_QUERY_SECONDS', os.environ.get('SLOW_QUERY_SECONDS', 0.25)))
+        # Debug mode is added on top per request: app.run(debug=True) only switches it on after import.
+        self.profiler_enabled = bool(config.get(
+            'PROFILER_ENABLED', os.environ.get('PROFILER_ENABLED') == '1'))
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        if db is not None:
+            with app.app_context():
+                for engine in db.engines.values():
+                    self.instrument_engine(engine)
+        app.extensions['metrics'] = self
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # Request cycle
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_seconds = 0.0
+        if (self.profiler_enabled or current_app.debug) and request.args.get('profile') == '1':
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    def _after_request(self, response):
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response = self._profile_response(profiler)
+        # Streamed bodies run their queries after this hook, so observe once the response is closed,
+        # by which time the request context may be gone; take what that needs now.
+        labels = (_endpoint(), request.method, str(response.status_code))
+        started = g.get('metrics_started', time.perf_counter())
+        counters = g._get_current_object()
+        response.call_on_close(lambda: self._observe_request(labels, started, counters))
+        return response
+
+    def _observe_request(self, labels, started, counters):
+        endpoint = labels[0]
+        self.request_duration.observe(labels, time.perf_counter() - started)
+        self.request_queries.observe((endpoint,), counters.get('metrics_queries', 0))
+        self.request_db_duration.observe((endpoint,), counters.get('metrics_db_seconds', 0.0))
+
+    def _profile_response(self, profiler):
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output).sort_stats('cumulative')
+        output.write(f'{request.method} {request.full_path}\n')
+        output.write(f"SQL statements: {g.get('metrics_queries', 0)}, "
+                     f"SQL time: {g.get('metrics_db_seconds', 0.0):.4f}s\n\n")
+        stats.print_stats(60)
+        return Response(output.getvalue(), mimetype='text/plain')
+
+    # Templates
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if has_request_context() and g.get('metrics_templates'):
+            elapsed = time.perf_counter() - g.metrics_templates.pop()
+            self.template_duration.observe((template.name or 'string',), elapsed)
+
+    # SQL
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_query_started'].pop()
+        if conn.info.get('metrics_explaining'):
+            return
+        if has_request_context():
+            g.metrics_queries = g.get('metrics_queries', 0) + 1
+            g.metrics_db_seconds = g.get('metrics_db_seconds', 0.0) + elapsed
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            endpoint = _endpoint() if has_request_context() else 'none'
+            self.slow_queries.inc((endpoint,))
+            logger.warning('Slow query (%.3fs, endpoint %s): %s\nParameters: %r\nPlan:\n%s',
+                           elapsed, endpoint, statement, parameters,
+                           self._explain(conn, statement, parameters, executemany))
+
+    def _explain(self, conn, statement, parameters, executemany):
+        if executemany or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return '(not captured)'
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        conn.info['metrics_explaining'] = True
+        try:
+            rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+            return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+        except Exception as e:
+            return f'(EXPLAIN failed: {e})'
+        finally:
+            conn.info['metrics_explaining'] = False
+
+    # Exposition
+
+    def render(self):
+        lines = []
+        for metric in (self.request_duration, self.request_queries, self.request_db_duration,
+                       self.template_duration, self.slow_queries):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -0,0 +1,122 @@
+from flask_sqlalchemy import SQLAlchemy
+
+from spatial import grid_cell
+from config import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Models
+class GridSubstation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    code = db.Column(db.String(50), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    current_load = db.Column(db.Float)
+    grid_cell = db.Column(db.Integer, index=True)
+    solar_plants = db.relationship('SolarPlant', backref='grid_substation', lazy=True)
+
+    # Keyset pagination seeks on (sort column, id); typeahead does case-insensitive prefix ranges.
+    __table_args__ = (
+        db.Index('ix_grid_substation_name_id', 'name', 'id'),
+        db.Index('ix_grid_substation_code_id', 'code', 'id'),
+        db.Index('ix_grid_substation_lower_name', db.func.lower(name)),
+        db.Index('ix_grid_substation_lower_code', db.func.lower(code)),
+    )
+
+class SubstationForecast(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    generation_forecast = db.Column(db.Float)
+    load_forecast = db.Column(db.Float)
+    substation = db.relationship('GridSubstation', backref=db.backref('forecasts', lazy=True))
+
+    # One row per substation per slot; also serves every substation + time range scan.
+    __table_args__ = (
+        db.Index('ix_substation_forecast_substation_timestamp', 'substation_id', 'timestamp', unique=True),
+    )
+
+class SubstationForecastArchive(db.Model):
+    # Cold storage for forecasts moved out of the hot table by archive_forecasts().
+    # Ids are its own: the hot table's are reused by SQLite once it has been emptied.
+    id = db.Column(db.Integer, primary_key=True)
+    substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    generation_forecast = db.Column(db.Float)
+    load_forecast = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_substation_forecast_archive_substation_timestamp', 'substation_id', 'timestamp', unique=True),
+    )
+
+class _ForecastRollup:
+    # Columns shared by the hourly and daily rollups, maintained by rollups.refresh_rollups().
+    substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    samples = db.Column(db.Integer, nullable=False)
+    generation_peak = db.Column(db.Float)
+    generation_energy = db.Column(db.Float)  # MWh
+    load_peak = db.Column(db.Float)
+    load_energy = db.Column(db.Float)  # MWh
+    net_load_min = db.Column(db.Float)  # load - generation; negative means reverse power flow
+    net_load_max = db.Column(db.Float)
+    reverse_flow_samples = db.Column(db.Integer, nullable=False)
+
+class SubstationForecastHourly(_ForecastRollup, db.Model):
+    __table_args__ = (
+        db.Index('ix_substation_forecast_hourly_bucket_start', 'bucket_start'),
+    )
+
+class SubstationForecastDaily(_ForecastRollup, db.Model):
+    __table_args__ = (
+        db.Index('ix_substation_forecast_daily_bucket_start', 'bucket_start'),
+    )
+
+class ForecastRun(db.Model):
+    # One row per forecast scheduler run, for freshness and failure monitoring.
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime)
+    status = db.Column(db.String(20), nullable=False)
+    error = db.Column(db.Text)
+    substations_recomputed = db.Column(db.Integer, nullable=False, default=0)
+    rows_written = db.Column(db.Integer, nullable=False, default=0)
+
+class SubstationForecastState(db.Model):
+    # What the scheduler last computed for a substation, so unchanged ones are only extended.
+    substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), primary_key=True)
+    plants_fingerprint = db.Column(db.String(64), nullable=False)
+    computed_until = db.Column(db.DateTime, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+class SolarPlant(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.Float, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    angle = db.Column(db.Float, nullable=False)
+    max_power = db.Column(db.Float, nullable=False)
+    owner_name = db.Column(db.String(100), nullable=False)
+    owner_account = db.Column(db.String(50), nullable=False)
+    grid_substation_id = db.Column(db.Integer, db.ForeignKey('grid_substation.id'), nullable=False)
+    connected_feeder = db.Column(db.String(100), nullable=False)
+    grid_cell = db.Column(db.Integer, index=True)
+
+    # Listing filters and keyset pagination seek on (column, id).
+    __table_args__ = (
+        db.Index('ix_solar_plant_name_id', 'name', 'id'),
+        db.Index('ix_solar_plant_size_id', 'size', 'id'),
+        db.Index('ix_solar_plant_grid_substation_id_id', 'grid_substation_id', 'id'),
+        db.Index('ix_solar_plant_connected_feeder_id', 'connected_feeder', 'id'),
+        db.Index('ix_solar_plant_owner_name_id', 'owner_name', 'id'),
+    )
+
+@db.event.listens_for(GridSubstation, 'before_insert')
+@db.event.listens_for(GridSubstation, 'before_update')
+@db.event.listens_for(SolarPlant, 'before_insert')
+@db.event.listens_for(SolarPlant, 'before_update')
+def _set_grid_cell(mapper, connection, target):
+    # Keep the spatial index column in step with the coordinates.
+    target.grid_cell = grid_cell(target.latitude, target.longitude)
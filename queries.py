@@ -0,0 +1,324 @@
+"""Batched read helpers shared by the views.
+
+Each helper issues a fixed number of statements no matter how many rows
+come back, so pages built on them don't degrade into one query per plant
+or per substation.
+"""
+import base64
+import json
+import math
+from datetime import datetime
+
+from sqlalchemy import Integer, cast, func, or_, tuple_
+from sqlalchemy.orm import joinedload
+
+import spatial
+from models import db, GridSubstation, SubstationForecast, SolarPlant
+
+
+def plants_with_substation(query=None):
+    """Plants with their grid substation loaded in the same SELECT."""
+    if query is None:
+        query = SolarPlant.query
+    return query.options(joinedload(SolarPlant.grid_substation)).all()
+
+
+PLANT_SORTS = {'id': SolarPlant.id, 'name': SolarPlant.name, 'size': SolarPlant.size}
+SUBSTATION_SORTS = {'id': GridSubstation.id, 'name': GridSubstation.name, 'code': GridSubstation.code}
+MAX_PER_PAGE = 200
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def _cursor_value(value, python_type):
+    # bool is an int to isinstance(), and JSON lets NaN and integers too large for a database column through.
+    if isinstance(value, bool):
+        return False
+    if python_type is str:
+        return isinstance(value, str)
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return python_type is float and isinstance(value, float) and math.isfinite(value)
+
+
+def decode_cursor(cursor, sort_type=None):
+    """Inverse of encode_cursor(); raises ValueError on a malformed cursor.
+
+    ``sort_type`` is the Python type of the sort column (str, int or
+    float); the sort value must be of that type, the id an int.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor')
+    sort_value, last_id = values
+    sort_types = (sort_type,) if sort_type else (str, int, float)
+    if not any(_cursor_value(sort_value, t) for t in sort_types) or not _cursor_value(last_id, int):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def prefix_filter(column, prefix):
+    # A range instead of LIKE 'prefix%' so a plain B-tree index on the column is usable.
+    return (column >= prefix) & (column < prefix + '\uffff')
+
+
+def keyset_page(query, sort_column, id_column, descending=False, after=None, per_page=50):
+    """One page of ``query`` ordered by (sort_column, id) starting after ``after``.
+
+    ``after`` is a cursor returned for the previous page.  Seeking on the
+    last row seen keeps every page an index range scan, however deep the
+    caller pages.  Returns (rows, cursor for the next page or None).
+    """
+    key = tuple_(sort_column, id_column)
+    if after is not None:
+        last = tuple_(*decode_cursor(after, sort_column.type.python_type))
+        query = query.filter(key < last if descending else key > last)
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    rows = query.limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    last_row = rows[-1]
+    return rows, encode_cursor([getattr(last_row, sort_column.key), last_row.id])
+
+
+def plant_page(substation_id=None, feeder=None, owner=None, min_size=None, max_size=None,
+               sort='name', descending=False, after=None, per_page=50):
+    """A filtered, sorted page of plants with their substations loaded."""
+    query = SolarPlant.query.options(joinedload(SolarPlant.grid_substation))
+    if substation_id is not None:
+        query = query.filter(SolarPlant.grid_substation_id == substation_id)
+    if feeder:
+        query = query.filter(SolarPlant.connected_feeder == feeder)
+    if owner:
+        query = query.filter(prefix_filter(SolarPlant.owner_name, owner))
+    if min_size is not None:
+        query = query.filter(SolarPlant.size >= min_size)
+    if max_size is not None:
+        query = query.filter(SolarPlant.size <= max_size)
+    return keyset_page(query, PLANT_SORTS[sort], SolarPlant.id, descending, after, per_page)
+
+
+def _substation_search_filter(q):
+    q = q.lower()
+    return prefix_filter(func.lower(GridSubstation.name), q) | prefix_filter(func.lower(GridSubstation.code), q)
+
+
+def substation_page(q=None, sort='name', descending=False, after=None, per_page=50):
+    """A sorted page of substations, optionally narrowed to a name/code prefix."""
+    query = GridSubstation.query
+    if q:
+        query = query.filter(_substation_search_filter(q))
+    return keyset_page(query, SUBSTATION_SORTS[sort], GridSubstation.id, descending, after, per_page)
+
+
+def search_substations(q, limit=10):
+    """Substations whose name or code starts with ``q`` (case-insensitive)."""
+    return GridSubstation.query.filter(_substation_search_filter(q)).order_by(
+        GridSubstation.name, GridSubstation.id
+    ).limit(limit).all()
+
+
+# Bucket name -> (SQLite strftime format, PostgreSQL date_trunc field).  The SQLite
+# formats match how SQLAlchemy stores DateTime there, so buckets compare with stored values.
+FORECAST_BUCKETS = {
+    'hour': ('%Y-%m-%d %H:00:00.000000', 'hour'),
+    'day': ('%Y-%m-%d 00:00:00.000000', 'day'),
+}
+
+
+def bucket_start(column, bucket):
+    sqlite_format, pg_field = FORECAST_BUCKETS[bucket]
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return func.strftime(sqlite_format, column)
+    return func.date_trunc(pg_field, column)
+
+
+def _isoformat(value):
+    # SQLite hands strftime() buckets back as strings, PostgreSQL as datetimes.
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.isoformat()
+
+
+def iter_substation_forecasts(substation_id, start, end, bucket=None, batch_size=1000):
+    """Yield one substation's forecasts in [start, end] in time order.
+
+    Without a bucket every stored point is yielded.  With ``bucket`` set to a
+    key of FORECAST_BUCKETS the points are aggregated in SQL and each item
+    carries the min/mean/max of generation and load for that bucket.
+    Rows are fetched in batches so the caller can stream them out.
+    """
+    in_window = (
+        (SubstationForecast.substation_id == substation_id)
+        & SubstationForecast.timestamp.between(start, end)
+    )
+
+    if bucket is None:
+        query = db.session.query(
+            SubstationForecast.timestamp,
+            SubstationForecast.generation_forecast,
+            SubstationForecast.load_forecast,
+        ).filter(in_window).order_by(SubstationForecast.timestamp)
+        for timestamp, generation, load in query.yield_per(batch_size):
+            yield {
+                'timestamp': timestamp.isoformat(),
+                'generation_forecast': generation,
+                'load_forecast': load
+            }
+        return
+
+    bucket_column = bucket_start(SubstationForecast.timestamp, bucket).label('bucket_start')
+    query = db.session.query(
+        bucket_column,
+        func.min(SubstationForecast.generation_forecast),
+        func.avg(SubstationForecast.generation_forecast),
+        func.max(SubstationForecast.generation_forecast),
+        func.min(SubstationForecast.load_forecast),
+        func.avg(SubstationForecast.load_forecast),
+        func.max(SubstationForecast.load_forecast),
+        func.count(),
+    ).filter(in_window).group_by(bucket_column).order_by(bucket_column)
+    for row in query.yield_per(batch_size):
+        yield {
+            'timestamp': _isoformat(row[0]),
+            'generation_min': row[1],
+            'generation_mean': row[2],
+            'generation_max': row[3],
+            'load_min': row[4],
+            'load_mean': row[5],
+            'load_max': row[6],
+            'samples': row[7]
+        }
+
+
+MAX_CELL_ROWS = 200  # beyond this a bbox is filtered on latitude/longitude ranges alone
+
+
+def plant_point(plant):
+    return {
+        'id': plant.id,
+        'name': plant.name,
+        'latitude': plant.latitude,
+        'longitude': plant.longitude,
+        'size': plant.size,
+        'angle': plant.angle,
+        'max_power': plant.max_power,
+        'owner_name': plant.owner_name,
+        'grid_substation': plant.grid_substation.name,
+        'connected_feeder': plant.connected_feeder
+    }
+
+
+def substation_point(sub):
+    return {
+        'id': sub.id,
+        'name': sub.name,
+        'code': sub.code,
+        'latitude': sub.latitude,
+        'longitude': sub.longitude,
+        'current_load': sub.current_load
+    }
+
+
+def _base_query(model):
+    if model is SolarPlant:
+        return SolarPlant.query.options(joinedload(SolarPlant.grid_substation))
+    return model.query
+
+
+def _cells_filter(model, ranges):
+    return or_(*[model.grid_cell.between(first, last) for first, last in ranges])
+
+
+def _bbox_filter(model, south, west, north, east):
+    in_latitude = model.latitude.between(south, north)
+    if west <= east:
+        in_longitude = model.longitude.between(west, east)
+    else:
+        in_longitude = (model.longitude >= west) | (model.longitude <= east)
+    ranges = spatial.cell_ranges(south, west, north, east)
+    if len(ranges) > MAX_CELL_ROWS:
+        return in_latitude & in_longitude
+    return _cells_filter(model, ranges) & in_latitude & in_longitude
+
+
+def _floor(expression):
+    # SQLite has no floor() unless built with math functions; CAST truncates, which
+    # is floor for the non-negative values used here.  PostgreSQL's CAST rounds.
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return cast(expression, Integer)
+    return func.floor(expression)
+
+
+def points_in_bbox(model, south, west, north, east, limit):
+    """Rows of ``model`` inside a bounding box, at most ``limit`` of them."""
+    return _base_query(model).filter(
+        _bbox_filter(model, south, west, north, east)
+    ).order_by(model.id).limit(limit).all()
+
+
+def clusters_in_bbox(model, south, west, north, east, degrees):
+    """Counts and centroids of ``model`` rows per ``degrees``-sized square in a bounding box."""
+    row = _floor((model.latitude + 90) / degrees).label('row')
+    column = _floor((model.longitude + 180) / degrees).label('col')
+    query = db.session.query(
+        func.count(), func.avg(model.latitude), func.avg(model.longitude)
+    ).filter(_bbox_filter(model, south, west, north, east)).group_by(row, column)
+    return [{'count': count, 'latitude': latitude, 'longitude': longitude}
+            for count, latitude, longitude in query]
+
+
+def _box_around(latitude, longitude, latitude_span, longitude_span):
+    south, north = max(-90.0, latitude - latitude_span), min(90.0, latitude + latitude_span)
+    if longitude_span >= 180:
+        return south, -180.0, north, 180.0
+    west, east = ((edge + 180) % 360 - 180 for edge in (longitude - longitude_span, longitude + longitude_span))
+    return south, west, north, east
+
+
+def _with_distances(rows, latitude, longitude):
+    return [(row, spatial.haversine_km(latitude, longitude, row.latitude, row.longitude)) for row in rows]
+
+
+def within_km(model, latitude, longitude, km):
+    """Rows of ``model`` within ``km`` of a point, nearest first, as (row, distance) pairs."""
+    latitude_span = km / 111.0
+    longitude_span = km / max(1e-6, 111.0 * math.cos(math.radians(min(89.9, abs(latitude) + latitude_span))))
+    box = _box_around(latitude, longitude, latitude_span, longitude_span)
+    found = _with_distances(_base_query(model).filter(_bbox_filter(model, *box)), latitude, longitude)
+    return sorted([pair for pair in found if pair[1] <= km], key=lambda pair: pair[1])
+
+
+def nearest(model, latitude, longitude, limit):
+    """The ``limit`` rows of ``model`` nearest a point, as (row, distance) pairs.
+
+    Searches a box of grid cells around the point, doubling it until
+    ``limit`` candidates lie within the distance the box is guaranteed to
+    cover, so sparse regions cost a few extra queries and dense ones read
+    only the cells next to the point.
+    """
+    degrees = spatial.CELL_DEGREES
+    while True:
+        box = _box_around(latitude, longitude, degrees, degrees)
+        found = _with_distances(_base_query(model).filter(_bbox_filter(model, *box)), latitude, longitude)
+        covers_globe = degrees >= 180
+        if covers_globe or sum(1 for _, distance in found if distance <= spatial.reach_km(latitude, degrees)) >= limit:
+            return sorted(found, key=lambda pair: pair[1])[:limit]
+        degrees *= 2
+
+
+def map_center():
+    """Centroid of all substations, used to position the map before any bbox is known."""
+    latitude, longitude = db.session.query(
+        func.avg(GridSubstation.latitude), func.avg(GridSubstation.longitude)
+    ).one()
+    return latitude, longitude
@@ -0,0 +1,183 @@
+"""Hourly and daily rollups of substation forecasts.
+
+Dashboard figures (peak generation, energy, net load and reverse power
+flow) are read from SubstationForecastHourly / SubstationForecastDaily
+instead of the raw 15-minute rows.  upsert_forecasts() calls
+refresh_rollups() for the substations and time span it just wrote, which
+recomputes only the hourly buckets that span touches and then the daily
+buckets from those hours, so maintenance cost follows the size of each
+write rather than the size of the table.
+
+Rollups are not touched by archive_forecasts(), so they keep summarising
+history after the raw rows have been moved out of the hot table.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, exists, func, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import (db, GridSubstation, SubstationForecast, SubstationForecastArchive, SubstationForecastDaily,
+                    SubstationForecastHourly)
+from queries import bucket_start
+
+STEP_HOURS = 0.25  # forecasts are 15-minute averages, so each row is a quarter-hour of energy
+FORECAST_COLUMNS = ('substation_id', 'timestamp', 'generation_forecast', 'load_forecast')
+VALUE_COLUMNS = ('samples', 'generation_peak', 'generation_energy', 'load_peak', 'load_energy',
+                 'net_load_min', 'net_load_max', 'reverse_flow_samples')
+
+
+def _upsert_from_select(model, rows):
+    dialect = db.session.get_bind().dialect.name
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(dialect)
+    if dialect_insert is None:
+        raise NotImplementedError(f'Forecast rollups are not supported on {dialect}')
+    stmt = dialect_insert(model.__table__).from_select(('substation_id', 'bucket_start') + VALUE_COLUMNS, rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['substation_id', 'bucket_start'],
+        set_={column: stmt.excluded[column] for column in VALUE_COLUMNS},
+    ))
+
+
+def _refresh_hourly(substation_ids, start, end, source=SubstationForecast.__table__):
+    forecast = source.c
+    hour = bucket_start(forecast.timestamp, 'hour')
+    net_load = forecast.load_forecast - forecast.generation_forecast
+    _upsert_from_select(SubstationForecastHourly, select(
+        forecast.substation_id,
+        hour,
+        func.count(),
+        func.max(forecast.generation_forecast),
+        func.sum(forecast.generation_forecast) * STEP_HOURS,
+        func.max(forecast.load_forecast),
+        func.sum(forecast.load_forecast) * STEP_HOURS,
+        func.min(net_load),
+        func.max(net_load),
+        func.sum(case((net_load < 0, 1), else_=0)),
+    ).where(
+        forecast.substation_id.in_(substation_ids), forecast.timestamp >= start, forecast.timestamp < end
+    ).group_by(forecast.substation_id, hour))
+
+
+def _refresh_daily(substation_ids, start, end):
+    hourly = SubstationForecastHourly
+    day = bucket_start(hourly.bucket_start, 'day')
+    _upsert_from_select(SubstationForecastDaily, select(
+        hourly.substation_id,
+        day,
+        func.sum(hourly.samples),
+        func.max(hourly.generation_peak),
+        func.sum(hourly.generation_energy),
+        func.max(hourly.load_peak),
+        func.sum(hourly.load_energy),
+        func.min(hourly.net_load_min),
+        func.max(hourly.net_load_max),
+        func.sum(hourly.reverse_flow_samples),
+    ).where(
+        hourly.substation_id.in_(substation_ids), hourly.bucket_start >= start, hourly.bucket_start < end
+    ).group_by(hourly.substation_id, day))
+
+
+def refresh_rollups(substation_ids, first, last):
+    """Recompute every rollup bucket of ``substation_ids`` touching [first, last].  Does not commit."""
+    substation_ids = list(substation_ids)
+    if not substation_ids:
+        return
+    hour_start = first.replace(minute=0, second=0, microsecond=0)
+    hour_end = last.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    day_start = hour_start.replace(hour=0)
+    day_end = last.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    _refresh_hourly(substation_ids, hour_start, hour_end)
+    _refresh_daily(substation_ids, day_start, day_end)
+
+
+def refresh_rollups_for_rows(rows):
+    """refresh_rollups() for exactly the substations and span covered by forecast ``rows``."""
+    spans = defaultdict(list)
+    for row in rows:
+        spans[row['substation_id']].append(row['timestamp'])
+    if spans:
+        timestamps = [timestamp for values in spans.values() for timestamp in values]
+        refresh_rollups(spans.keys(), min(timestamps), max(timestamps))
+
+
+def _all_forecasts():
+    # Hot and archived rows together; a slot re-ingested after archiving counts once, with its hot values.
+    hot = SubstationForecast.__table__
+    archive = SubstationForecastArchive.__table__
+    archived = select(*(archive.c[c] for c in FORECAST_COLUMNS)).where(~exists().where(
+        hot.c.substation_id == archive.c.substation_id, hot.c.timestamp == archive.c.timestamp
+    ))
+    return union_all(select(*(hot.c[c] for c in FORECAST_COLUMNS)), archived).subquery('forecast')
+
+
+def rebuild_rollups():
+    """Recompute both rollup tables from scratch from the hot and archived forecasts.  Does not commit."""
+    db.session.execute(delete(SubstationForecastDaily))
+    db.session.execute(delete(SubstationForecastHourly))
+    forecasts = _all_forecasts()
+    first, last = db.session.query(func.min(forecasts.c.timestamp), func.max(forecasts.c.timestamp)).one()
+    if first is None:
+        return
+    substation_ids = [sub_id for sub_id, in db.session.query(GridSubstation.id)]
+    # An archive cutoff can fall inside an hour, so each hour is built from both tables at once.
+    _refresh_hourly(substation_ids, first.replace(minute=0, second=0, microsecond=0), last + timedelta(hours=1),
+                    forecasts)
+    _refresh_daily(substation_ids, first.replace(hour=0, minute=0, second=0, microsecond=0),
+                   last + timedelta(days=1))
+
+
+def substation_summary(start_day, days):
+    """Daily rollups for every substation over ``days`` days from ``start_day``.
+
+    Reads one row per substation per day.  Returns a list of per-substation
+    dicts with the daily figures and their totals over the period, the
+    substations at risk of reverse power flow first.
+    """
+    daily = SubstationForecastDaily
+    end_day = start_day + timedelta(days=days)
+    in_period = (
+        (daily.substation_id == GridSubstation.id)
+        & (daily.bucket_start >= start_day)
+        & (daily.bucket_start < end_day)
+    )
+    rows = db.session.query(GridSubstation, daily).outerjoin(daily, in_period).order_by(
+        GridSubstation.name, GridSubstation.id, daily.bucket_start
+    )
+    summaries = {}
+    for substation, day in rows:
+        summary = summaries.setdefault(substation.id, {
+            'id': substation.id, 'name': substation.name, 'code': substation.code, 'days': []
+        })
+        if day is not None:
+            summary['days'].append({
+                'date': day.bucket_start.date().isoformat(),
+                'generation_peak': day.generation_peak,
+                'generation_energy': day.generation_energy,
+                'load_peak': day.load_peak,
+                'load_energy': day.load_energy,
+                'net_load_min': day.net_load_min,
+                'net_load_max': day.net_load_max,
+                'reverse_flow_hours': day.reverse_flow_samples * STEP_HOURS
+            })
+
+    def total(values, how):
+        values = [value for value in values if value is not None]
+        return how(values) if values else None
+
+    for summary in summaries.values():
+        daily_figures = summary['days']
+        summary.update(
+            generation_peak=total([d['generation_peak'] for d in daily_figures], max),
+            generation_energy=total([d['generation_energy'] for d in daily_figures], sum),
+            load_peak=total([d['load_peak'] for d in daily_figures], max),
+            load_energy=total([d['load_energy'] for d in daily_figures], sum),
+            net_load_min=total([d['net_load_min'] for d in daily_figures], min),
+            reverse_flow_hours=sum(d['reverse_flow_hours'] for d in daily_figures),
+        )
+        summary['reverse_flow_risk'] = summary['reverse_flow_hours'] > 0
+    return sorted(summaries.values(), key=lambda summary: not summary['reverse_flow_risk'])
+
+
+def today():
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -0,0 +1,194 @@
+"""Background refresh of generation forecasts over the rolling window.
+
+Started with ``flask forecast-scheduler`` (the ``scheduler`` process in
+the Procfile), never inside a web worker.  Each run:
+
+1. reads every plant once and fingerprints the plants of each substation;
+2. recomputes the whole window for substations whose fingerprint changed
+   (plants added, edited, moved or deleted) and only the newly uncovered
+   tail of the window for the rest;
+3. shards that work by substation across a process pool, where workers
+   do pure NumPy and never touch the database;
+4. upserts each shard's rows and commits as soon as it comes back, so a
+   crash part way through keeps everything finished so far.
+
+Every run is recorded in ForecastRun; status() summarises the latest
+ones for the /api/scheduler/status endpoint.
+"""
+import hashlib
+import logging
+import os
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from models import db, ForecastRun, GridSubstation, SolarPlant, SubstationForecastState
+from forecasting import STEP_MINUTES, forecast_times, generation_rows, substation_generation_mw
+from ingest import upsert_forecasts
+from cache import cache
+
+logger = logging.getLogger(__name__)
+
+FLEET_COLUMNS = ('latitude', 'longitude', 'size', 'angle', 'max_power')
+SHARDS_PER_WORKER = 4
+
+
+def window_start(now):
+    """``now`` rounded down to the forecast step."""
+    now = now.replace(second=0, microsecond=0)
+    return now - timedelta(minutes=now.minute % STEP_MINUTES)
+
+
+def _fleet_by_substation():
+    # One pass over all plants: per-substation arrays and a fingerprint of everything the model reads.
+    plants = defaultdict(list)
+    query = db.session.query(
+        SolarPlant.grid_substation_id, SolarPlant.id, *(getattr(SolarPlant, name) for name in FLEET_COLUMNS)
+    ).order_by(SolarPlant.grid_substation_id, SolarPlant.id)
+    for substation_id, *row in query:
+        plants[substation_id].append(row)
+    fleets, fingerprints = {}, {}
+    for substation_id in (sub_id for sub_id, in db.session.query(GridSubstation.id)):
+        rows = plants.get(substation_id, [])
+        fingerprints[substation_id] = hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+        columns = list(zip(*rows)) if rows else [()] * (len(FLEET_COLUMNS) + 1)
+        fleets[substation_id] = {
+            name: np.array(columns[i + 1], dtype=np.float64) for i, name in enumerate(FLEET_COLUMNS)
+        }
+    return fleets, fingerprints
+
+
+def plan(fleets, fingerprints, start, end):
+    """Work items (substation_id, fingerprint, fleet, from) still needed to cover [start, end)."""
+    states = {state.substation_id: state for state in SubstationForecastState.query}
+    work = []
+    for substation_id, fingerprint in fingerprints.items():
+        state = states.get(substation_id)
+        if state is None or state.plants_fingerprint != fingerprint:
+            work.append((substation_id, fingerprint, fleets[substation_id], start))
+        elif state.computed_until < end:
+            work.append((substation_id, fingerprint, fleets[substation_id], max(state.computed_until, start)))
+    return work
+
+
+def compute_shard(items, end):
+    """Worker entry point: generation series for each (substation_id, fleet, from) item."""
+    results = []
+    for substation_id, fleet, begin in items:
+        times = forecast_times(begin, end=end)
+        fleet = dict(fleet, grid_substation_id=np.full(len(fleet['size']), substation_id, dtype=np.int64))
+        _, generation = substation_generation_mw(fleet, times, [substation_id])
+        results.append((substation_id, times, generation))
+    return results
+
+
+def _shards(work, count):
+    # Greedy balance by plant count so one big substation doesn't hold up the run.
+    shards = [[] for _ in range(max(1, count))]
+    loads = [0] * len(shards)
+    for item in sorted(work, key=lambda item: -len(item[2]['size'])):
+        i = loads.index(min(loads))
+        shards[i].append(item)
+        loads[i] += len(item[2]['size']) + 1
+    return [shard for shard in shards if shard]
+
+
+def run_once(executor, workers, days=3, now=None):
+    """Run one refresh on ``executor`` (a pool of ``workers``) and record it in ForecastRun.
+
+    Returns the run.
+    """
+    run = ForecastRun(started_at=datetime.utcnow(), status='running')
+    db.session.add(run)
+    db.session.commit()
+    try:
+        start = window_start(now or run.started_at)
+        end = start + timedelta(days=days)
+        fleets, fingerprints = _fleet_by_substation()
+        work = plan(fleets, fingerprints, start, end)
+        fingerprint_of = {item[0]: item[1] for item in work}
+        futures = [
+            executor.submit(compute_shard, [(sub_id, fleet, begin) for sub_id, _, fleet, begin in shard], end)
+            for shard in _shards(work, workers * SHARDS_PER_WORKER)
+        ]
+        for future in as_completed(futures):
+            for substation_id, times, generation in future.result():
+                run.rows_written += upsert_forecasts(
+                    generation_rows(np.array([substation_id]), generation, times),
+                    value_fields=('generation_forecast',)
+                )
+                db.session.merge(SubstationForecastState(
+                    substation_id=substation_id, plants_fingerprint=fingerprint_of[substation_id],
+                    computed_until=end, computed_at=datetime.utcnow()
+                ))
+                run.substations_recomputed += 1
+            db.session.commit()
+            cache.invalidate('forecasts')
+        run.status = 'succeeded'
+    except Exception:
+        db.session.rollback()
+        run.status = 'failed'
+        run.error = traceback.format_exc()[-4000:]
+        logger.exception('Forecast refresh failed')
+    run.finished_at = datetime.utcnow()
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def run_forever(interval, workers=None, days=3):
+    """Refresh every ``interval`` seconds until interrupted."""
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            run = run_once(executor, workers, days)
+            duration = (run.finished_at - run.started_at).total_seconds()
+            logger.info('Forecast refresh %s in %.1fs: %d substations, %d rows',
+                        run.status, duration, run.substations_recomputed, run.rows_written)
+            if run.status == 'failed':
+                # A worker that died (e.g. OOM-killed) breaks the pool for good, so start afresh.
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+            time.sleep(max(0.0, interval - duration))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def status(now=None, days=3):
+    """Freshness of the forecasts and the outcome of the latest scheduler runs."""
+    now = now or datetime.utcnow()
+    latest = ForecastRun.query.order_by(ForecastRun.started_at.desc()).first()
+    last_success = ForecastRun.query.filter_by(status='succeeded').order_by(ForecastRun.started_at.desc()).first()
+    oldest_horizon = db.session.query(db.func.min(SubstationForecastState.computed_until)).join(
+        GridSubstation, GridSubstation.id == SubstationForecastState.substation_id
+    ).scalar()
+    wanted_horizon = window_start(now) + timedelta(days=days)
+
+    def describe(run):
+        if run is None:
+            return None
+        return {
+            'id': run.id,
+            'status': run.status,
+            'started_at': run.started_at.isoformat(),
+            'finished_at': run.finished_at.isoformat() if run.finished_at else None,
+            'duration_seconds': (run.finished_at - run.started_at).total_seconds() if run.finished_at else None,
+            'substations_recomputed': run.substations_recomputed,
+            'rows_written': run.rows_written,
+            'error': run.error
+        }
+
+    return {
+        'last_run': describe(latest),
+        'last_success': describe(last_success),
+        # How long ago forecasts were last brought fully up to date.
+        'lag_seconds': (now - last_success.finished_at).total_seconds() if last_success else None,
+        # How far short of the rolling window the least fresh substation's forecast ends.
+        'horizon_shortfall_seconds': max(0.0, (wanted_horizon - oldest_horizon).total_seconds())
+        if oldest_horizon else None
+    }
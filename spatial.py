@@ -0,0 +1,72 @@
+"""Grid-cell spatial indexing for plants and substations.
+
+The globe is cut into fixed CELL_DEGREES x CELL_DEGREES cells numbered row
+by row from the south-west corner, and every located row stores the
+number of its cell in an indexed ``grid_cell`` column.  Cells in one grid
+row are numbered consecutively, so a bounding box becomes one
+``grid_cell BETWEEN a AND b`` range per grid row it spans; nearest-N
+searches double a box of cells around the origin until enough candidates
+have been seen.  Both only ever touch the cells near the query.
+"""
+import math
+
+CELL_DEGREES = 0.05  # about 5.5 km north-south
+COLUMNS = int(round(360 / CELL_DEGREES))
+ROWS = int(round(180 / CELL_DEGREES))
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _row(latitude):
+    return min(ROWS - 1, max(0, int(math.floor((latitude + 90) / CELL_DEGREES))))
+
+
+def _column(longitude):
+    return min(COLUMNS - 1, max(0, int(math.floor((longitude + 180) / CELL_DEGREES))))
+
+
+def grid_cell(latitude, longitude):
+    """Number of the grid cell containing a point."""
+    return _row(latitude) * COLUMNS + _column(longitude)
+
+
+def cell_ranges(south, west, north, east):
+    """Inclusive (first, last) grid_cell ranges covering a bounding box.
+
+    Coordinates are clamped to the globe; a box crossing the antimeridian
+    (west > east) is split in two.
+    """
+    south, north = (min(90.0, max(-90.0, latitude)) for latitude in (south, north))
+    west, east = (min(180.0, max(-180.0, longitude)) for longitude in (west, east))
+    if west > east:
+        columns = [(_column(west), COLUMNS - 1), (0, _column(east))]
+    else:
+        columns = [(_column(west), _column(east))]
+    return [
+        (row * COLUMNS + first_column, row * COLUMNS + last_column)
+        for row in range(_row(south), _row(north) + 1)
+        for first_column, last_column in columns
+    ]
+
+
+def reach_km(latitude, degrees):
+    """Distance from a point guaranteed to lie inside a box of +/- ``degrees`` around it."""
+    # Meridians converge towards the poles, so the east-west half-width is the limiting one.
+    east_west = degrees * math.cos(math.radians(min(89.9, abs(latitude) + degrees)))
+    return math.radians(min(degrees, east_west)) * EARTH_RADIUS_KM
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cluster_degrees(zoom):
+    """Cluster cell size for a web-map zoom level, or None to show individual markers.
+
+    Roughly 60 screen pixels per cluster on 256-pixel tiles.
+    """
+    if zoom is None or zoom >= 11:
+        return None
+    return 360.0 / (2 ** zoom) * 60 / 256
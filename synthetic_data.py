@@ -0,0 +1,124 @@
+"""Synthetic fleets for load tests and benchmarks.
+
+generate_fleet() adds N substations, M plants spread around them and H
+days of 15-minute load and generation forecasts, written with multi-row
+inserts and the forecast upsert pipeline (so the rollups are filled in
+too).  Everything lies inside Sri Lanka, and the same seed always
+produces the same fleet.  Run it with ``flask generate-fleet``.
+"""
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, insert
+
+from models import db, GridSubstation, SolarPlant
+from spatial import grid_cell
+from forecasting import forecast_times, substation_generation_mw
+from ingest import upsert_forecasts
+from rollups import today
+from cache import cache
+
+SOUTH, WEST, NORTH, EAST = 5.9, 79.6, 9.8, 81.9
+PLANT_SPREAD_DEGREES = 0.05  # plants sit within a few km of their substation
+INSERT_BATCH = 5000
+FORECAST_CHUNK = 50  # substations per forecast upsert and commit
+
+
+def _first_number(model):
+    # Numbers only name the rows; ids are left to the database so its sequences stay in step.
+    return db.session.query(func.count(model.id)).scalar() + 1
+
+
+def _insert(model, rows):
+    """Insert ``rows`` in batches; returns their new ids in order."""
+    ids = []
+    stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+    for start in range(0, len(rows), INSERT_BATCH):
+        ids.extend(db.session.scalars(stmt, rows[start:start + INSERT_BATCH]))
+    return ids
+
+
+def _substations(count, rng):
+    first = _first_number(GridSubstation)
+    latitude = rng.uniform(SOUTH, NORTH, count)
+    longitude = rng.uniform(WEST, EAST, count)
+    load = rng.uniform(5, 80, count)
+    rows = [
+        {'name': f'Synthetic Substation {first + i:05d}', 'code': f'SYN{first + i:05d}',
+         'latitude': lat, 'longitude': lon, 'current_load': round(current_load, 2), 'grid_cell': grid_cell(lat, lon)}
+        for i, (lat, lon, current_load) in enumerate(zip(latitude.tolist(), longitude.tolist(), load.tolist()))
+    ]
+    ids = _insert(GridSubstation, rows)
+    return np.array(ids, dtype=np.int64), latitude, longitude, load
+
+
+def _plants(count, substation_ids, substation_lat, substation_lon, rng):
+    first = _first_number(SolarPlant)
+    owner = rng.integers(0, substation_ids.size, count)
+    latitude = np.clip(substation_lat[owner] + rng.normal(0, PLANT_SPREAD_DEGREES, count), SOUTH, NORTH)
+    longitude = np.clip(substation_lon[owner] + rng.normal(0, PLANT_SPREAD_DEGREES, count), WEST, EAST)
+    size = rng.uniform(3, 500, count)
+    fleet = {
+        'grid_substation_id': substation_ids[owner],
+        'latitude': latitude,
+        'longitude': longitude,
+        'size': size,
+        'angle': rng.uniform(5, 35, count),
+        'max_power': size * rng.uniform(0.7, 1.0, count),
+    }
+    feeders = rng.integers(1, 9, count)
+    rows = [
+        {'name': f'Synthetic Plant {first + i:07d}', 'size': round(size, 2),
+         'latitude': lat, 'longitude': lon, 'angle': round(angle, 1), 'max_power': round(max_power, 2),
+         'owner_name': f'Owner {(first + i) % 997:03d}', 'owner_account': f'SYN{first + i:08d}',
+         'grid_substation_id': substation_id, 'connected_feeder': f'F{substation_id}-{feeder}',
+         'grid_cell': grid_cell(lat, lon)}
+        for i, (substation_id, lat, lon, size, angle, max_power, feeder) in enumerate(zip(
+            fleet['grid_substation_id'].tolist(), latitude.tolist(), longitude.tolist(), size.tolist(),
+            fleet['angle'].tolist(), fleet['max_power'].tolist(), feeders.tolist()
+        ))
+    ]
+    _insert(SolarPlant, rows)
+    return fleet
+
+
+def _forecasts(substation_ids, base_load, fleet, start, days, rng):
+    times = forecast_times(start, days)
+    timestamps = times.astype('datetime64[us]').astype(datetime).tolist()
+    hours = (times - times.astype('datetime64[D]')).astype('timedelta64[m]').astype(np.float64) / 60
+    daily_cycle = 1 + 0.3 * np.sin(hours / 12 * np.pi)
+    written = 0
+    for start_index in range(0, substation_ids.size, FORECAST_CHUNK):
+        ids = substation_ids[start_index:start_index + FORECAST_CHUNK]
+        in_chunk = np.isin(fleet['grid_substation_id'], ids)
+        _, generation = substation_generation_mw({name: values[in_chunk] for name, values in fleet.items()},
+                                                 times, ids)
+        load = (base_load[start_index:start_index + ids.size, None] * daily_cycle[None, :]
+                * rng.uniform(0.9, 1.1, (ids.size, times.size)) * 1.1)
+        rows = [
+            {'substation_id': substation_id, 'timestamp': timestamp,
+             'generation_forecast': generation_value, 'load_forecast': load_value}
+            for substation_id, generation_series, load_series in zip(
+                ids.tolist(), np.round(generation, 4).tolist(), np.round(load, 2).tolist())
+            for timestamp, generation_value, load_value in zip(timestamps, generation_series, load_series)
+        ]
+        written += upsert_forecasts(rows)
+        db.session.commit()
+    return written
+
+
+def generate_fleet(substations, plants, days=3, start=None, seed=0):
+    """Add a synthetic fleet and ``days`` days of forecasts from ``start`` (default: today, UTC).
+
+    Commits.  Returns the number of substations, plants and forecast rows written.
+    """
+    rng = np.random.default_rng(seed)
+    substation_ids, latitude, longitude, base_load = _substations(substations, rng)
+    fleet = _plants(plants, substation_ids, latitude, longitude, rng) if substations else None
+    db.session.commit()
+    cache.invalidate('plants', 'substations')
+    forecast_rows = 0
+    if days and substations:
+        forecast_rows = _forecasts(substation_ids, base_load, fleet, start or today(), days, rng)
+        cache.invalidate('forecasts')
+    return {'substations': substations, 'plants': plants if substations else 0, 'forecasts': forecast_rows}
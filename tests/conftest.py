@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py reads its configuration at import time, so point it at a throwaway database before anything imports it.
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp.name, 'test.db')
+os.environ['CACHE_BACKEND'] = 'null'  # every request reaches the database
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db  # noqa: E402
+from maintenance import upgrade_database  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        upgrade_database()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,49 @@
+from flask import Flask
+
+from cache import Cache, source_version
+
+
+def shared_cache(tmp_path, **config):
+    app = Flask(__name__, instance_path=str(tmp_path / 'instance'))
+    app.config.update(CACHE_BACKEND='sqlite', CACHE_PATH=str(tmp_path / 'cache.db'), **config)
+    return Cache(app)
+
+
+def test_etag_survives_a_restart_of_the_same_deploy(tmp_path):
+    before = shared_cache(tmp_path, APP_VERSION='a')
+    after = shared_cache(tmp_path, APP_VERSION='a')
+    assert after.etag(after.key('map', ('plants',))) == before.etag(before.key('map', ('plants',)))
+
+
+def test_etag_changes_with_the_deploy(tmp_path):
+    before = shared_cache(tmp_path, APP_VERSION='a')
+    after = shared_cache(tmp_path, APP_VERSION='b')
+    assert after.etag(after.key('map', ('plants',))) != before.etag(before.key('map', ('plants',)))
+
+
+def test_source_version_follows_the_templates(tmp_path):
+    (tmp_path / 'templates').mkdir()
+    template = tmp_path / 'templates' / 'map.html'
+    template.write_text('<p>old</p>')
+    app = Flask(__name__, root_path=str(tmp_path))
+    old = source_version(app)
+    assert source_version(app) == old
+    template.write_text('<p>new</p>')
+    assert source_version(app) != old
+
+
+def test_invalidate_changes_keys(tmp_path):
+    cache = shared_cache(tmp_path, APP_VERSION='a')
+    key = cache.key('plants', ('plants',))
+    cache.invalidate('substations')
+    assert cache.key('plants', ('plants',)) == key
+    cache.invalidate('plants')
+    assert cache.key('plants', ('plants',)) != key
+
+
+def test_eviction_keeps_tag_versions(tmp_path):
+    cache = shared_cache(tmp_path, APP_VERSION='a', CACHE_MAX_ENTRIES=5)
+    key = cache.key('map', ('plants',))
+    for i in range(20):
+        cache.get_or_set(cache.key('points', ('plants',), i), lambda: i)
+    assert cache.key('map', ('plants',)) == key
@@ -0,0 +1,85 @@
+import io
+from datetime import datetime
+
+import pytest
+
+from ingest import IngestError, ingest_forecasts, upsert_forecasts
+from models import db, GridSubstation, SubstationForecast, SubstationForecastHourly
+
+
+@pytest.fixture
+def substation(app):
+    substation = GridSubstation(name='Test', code='T1', latitude=7.0, longitude=80.0)
+    db.session.add(substation)
+    db.session.commit()
+    return substation.id
+
+
+def ingest(text, fmt, chunk_size=5000):
+    return ingest_forecasts(io.StringIO(text), fmt, chunk_size)
+
+
+def stored(substation_id):
+    return {row.timestamp: (row.generation_forecast, row.load_forecast)
+            for row in SubstationForecast.query.filter_by(substation_id=substation_id)}
+
+
+def test_upsert_updates_rows_in_place(substation):
+    at = datetime(2030, 1, 1)
+    upsert_forecasts([{'substation_id': substation, 'timestamp': at, 'generation_forecast': 1.0, 'load_forecast': 5.0}])
+    upsert_forecasts([{'substation_id': substation, 'timestamp': at, 'generation_forecast': 2.0}],
+                     value_fields=('generation_forecast',))
+    db.session.commit()
+    assert stored(substation) == {at: (2.0, 5.0)}
+    assert SubstationForecastHourly.query.one().generation_peak == 2.0
+
+
+def test_csv_feed_is_idempotent(substation):
+    feed = f'substation_id,timestamp,generation_forecast,load_forecast\n{substation},2030-01-01T00:00:00,1.5,4\n'
+    assert ingest(feed, 'csv') == 1
+    assert ingest(feed, 'csv') == 1
+    assert stored(substation) == {datetime(2030, 1, 1): (1.5, 4.0)}
+
+
+def test_offsets_are_stored_as_naive_utc(substation):
+    feed = (f'{{"substation_id": {substation}, "timestamp": "2030-01-01T12:00:00+05:30", "load_forecast": 1}}\n'
+            f'{{"substation_id": {substation}, "timestamp": "2030-01-01T07:00:00", "load_forecast": 2}}\n')
+    assert ingest(feed, 'jsonl') == 2
+    assert stored(substation) == {datetime(2030, 1, 1, 6, 30): (None, 1.0), datetime(2030, 1, 1, 7): (None, 2.0)}
+
+
+def test_left_out_field_is_rejected_not_nulled(substation):
+    ingest(f'{{"substation_id": {substation}, "timestamp": "2030-01-02T00:00:00", "load_forecast": 9}}\n', 'jsonl')
+    feed = (f'{{"substation_id": {substation}, "timestamp": "2030-01-01T00:00:00", '
+            f'"generation_forecast": 1, "load_forecast": 2}}\n'
+            f'{{"substation_id": {substation}, "timestamp": "2030-01-02T00:00:00", "generation_forecast": 3}}\n')
+    with pytest.raises(IngestError, match='Missing load_forecast') as e:
+        ingest(feed, 'jsonl', chunk_size=1)
+    assert (e.value.line, e.value.rows) == (2, 1)
+    assert stored(substation)[datetime(2030, 1, 2)] == (None, 9.0)
+
+
+@pytest.mark.parametrize('fmt, feed, message', [
+    ('jsonl', '{{"substation_id": 1.7, "timestamp": "2030-01-01", "load_forecast": 1}}', 'integer'),
+    ('jsonl', '{{"substation_id": true, "timestamp": "2030-01-01", "load_forecast": 1}}', 'integer'),
+    ('jsonl', '{{"substation_id": {id}, "timestamp": "2030-01-01", "load_forecast": NaN}}', 'finite'),
+    ('jsonl', '{{"substation_id": {id}, "timestamp": "yesterday", "load_forecast": 1}}', 'yesterday'),
+    ('jsonl', '{{"substation_id": {id}, "timestamp": "2030-01-01", "load_forecast": 1, "x": 2}}', 'Unexpected'),
+    ('jsonl', '{{"substation_id": 999, "timestamp": "2030-01-01", "load_forecast": 1}}', 'Unknown'),
+    ('jsonl', '[1, 2]', 'JSON object'),
+    ('csv', 'substation_id,timestamp,load_forecast\n{id},2030-01-01,inf', 'finite'),
+    ('csv', 'substation_id,timestamp,load_forecast\n{id},2030-01-01,1,2', 'More fields'),
+    ('csv', 'substation_id,timestamp,load_forecast\n{id},2030-01-01', 'Fewer fields'),
+    ('csv', 'substation_id,timestamp\n{id},2030-01-01', 'at least one'),
+])
+def test_invalid_records_are_rejected(substation, fmt, feed, message):
+    with pytest.raises(IngestError, match=message):
+        ingest(feed.format(id=substation) + '\n', fmt)
+    assert stored(substation) == {}
+
+
+def test_bulk_endpoint_reports_bad_encoding(app, substation):
+    response = app.test_client().post('/api/forecasts/bulk', content_type='text/csv',
+                                      data=b'substation_id,timestamp,load_forecast\n1,2030-01-01,\xff\n')
+    assert response.status_code == 400
+    assert 'UTF-8' in response.get_json()['error']
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from ingest import upsert_forecasts
+from models import db, GridSubstation
+
+
+def observed(client, endpoint):
+    """(count, sum) of the SQL-statements-per-request histogram for ``endpoint``, read from /metrics."""
+    values = {'count': 0, 'sum': 0.0}
+    for line in client.get('/metrics').text.splitlines():
+        for key in values:
+            if line.startswith(f'http_request_db_queries_{key}{{endpoint="{endpoint}"}}'):
+                values[key] = float(line.split()[-1])
+    return values['count'], values['sum']
+
+
+def test_streamed_response_queries_are_counted(app):
+    substation = GridSubstation(name='Test', code='T1', latitude=7.0, longitude=80.0)
+    db.session.add(substation)
+    db.session.commit()
+    substation_id = substation.id
+    start = datetime(2030, 1, 1)
+    upsert_forecasts([{'substation_id': substation_id, 'timestamp': start + timedelta(minutes=15 * i),
+                       'generation_forecast': 1.0, 'load_forecast': 2.0} for i in range(8)])
+    db.session.commit()
+    db.session.expunge_all()  # so the view has to load the substation itself
+    client = app.test_client()
+    count_before, queries_before = observed(client, 'substation_forecasts')
+
+    response = client.get(f'/api/substations/{substation_id}/forecasts?start={start.isoformat()}')
+    assert len(response.get_json()['forecasts']) == 8
+    response.close()
+
+    count, queries = observed(client, 'substation_forecasts')
+    # The substation lookup before streaming and the forecast SELECT inside the stream.
+    assert (count - count_before, queries - queries_before) == (1, 2)
@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from models import db
+from rollups import today
+from synthetic_data import generate_fleet
+
+PLANTS_PER_SUBSTATION = 5
+ROUTES = (
+    '/',
+    '/map',
+    '/plants',
+    '/substations',
+    '/api/map/points?bbox=5.9,79.6,9.8,81.9&zoom=13',
+    '/api/map/points?bbox=5.9,79.6,9.8,81.9&zoom=8',
+    '/api/summary',
+)
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def executed(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'after_cursor_execute', executed)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', executed)
+
+
+def statements_per_route(app):
+    client = app.test_client()
+    counts = {}
+    for route in ROUTES:
+        with count_statements() as statements:
+            response = client.get(route)
+        assert response.status_code == 200, route
+        counts[route] = len(statements)
+    return counts
+
+
+@pytest.mark.parametrize('route', ROUTES)
+def test_statement_count_does_not_grow_with_substations(app, route):
+    generate_fleet(2, 2 * PLANTS_PER_SUBSTATION, days=1, start=today())
+    small = statements_per_route(app)
+    generate_fleet(18, 18 * PLANTS_PER_SUBSTATION, days=1, start=today(), seed=1)
+    large = statements_per_route(app)
+    assert large[route] == small[route]
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from ingest import upsert_forecasts
+from maintenance import archive_forecasts
+from models import db, GridSubstation, SubstationForecastDaily, SubstationForecastHourly
+from rollups import rebuild_rollups, substation_summary
+
+DAY = datetime(2030, 1, 1)
+
+
+@pytest.fixture
+def substations(app):
+    rows = [GridSubstation(name=name, code=name, latitude=7.0, longitude=80.0) for name in ('A', 'B')]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def write(substation_id, start, generation, load):
+    rows = [{'substation_id': substation_id, 'timestamp': start + timedelta(minutes=15 * i),
+             'generation_forecast': g, 'load_forecast': l} for i, (g, l) in enumerate(zip(generation, load))]
+    upsert_forecasts(rows)
+    db.session.commit()
+
+
+def rollup(model, substation_id, bucket_start):
+    row = db.session.get(model, (substation_id, bucket_start))
+    return {column: getattr(row, column) for column in ('samples', 'generation_peak', 'generation_energy',
+                                                        'load_peak', 'load_energy', 'net_load_min',
+                                                        'net_load_max', 'reverse_flow_samples')}
+
+
+def snapshot():
+    return sorted((row.substation_id, row.bucket_start, row.samples, row.generation_energy, row.load_energy)
+                  for model in (SubstationForecastHourly, SubstationForecastDaily) for row in model.query)
+
+
+def test_hourly_and_daily_figures(substations):
+    a, _ = substations
+    write(a, DAY + timedelta(hours=12), [1, 2, 3, 4], [2, 2, 2, 2])
+    write(a, DAY + timedelta(hours=13), [0, 0, 0, 0], [4, 4, 4, 4])
+    assert rollup(SubstationForecastHourly, a, DAY + timedelta(hours=12)) == {
+        'samples': 4, 'generation_peak': 4, 'generation_energy': 2.5, 'load_peak': 2, 'load_energy': 2.0,
+        'net_load_min': -2, 'net_load_max': 1, 'reverse_flow_samples': 2,
+    }
+    assert rollup(SubstationForecastDaily, a, DAY) == {
+        'samples': 8, 'generation_peak': 4, 'generation_energy': 2.5, 'load_peak': 4, 'load_energy': 6.0,
+        'net_load_min': -2, 'net_load_max': 4, 'reverse_flow_samples': 2,
+    }
+
+
+def test_incremental_refresh_matches_a_rebuild(substations):
+    a, b = substations
+    write(a, DAY, [1] * 96, [2] * 96)
+    write(b, DAY, [3] * 96, [1] * 96)
+    write(a, DAY + timedelta(hours=5), [9, 9], [1, 1])
+    write(b, DAY + timedelta(days=1), [1], [1])
+    assert rollup(SubstationForecastHourly, a, DAY + timedelta(hours=5))['generation_peak'] == 9
+    assert rollup(SubstationForecastHourly, a, DAY + timedelta(hours=6))['generation_peak'] == 1
+    incremental = snapshot()
+    rebuild_rollups()
+    db.session.commit()
+    assert snapshot() == incremental
+
+
+def test_rebuild_keeps_archived_periods(substations):
+    a, _ = substations
+    write(a, DAY, [1] * 192, [2] * 192)
+    before = snapshot()
+    archive_forecasts(1, now=DAY + timedelta(days=2, minutes=30))
+    rebuild_rollups()
+    db.session.commit()
+    assert snapshot() == before
+
+
+def test_summary_totals_and_reverse_flow_first(substations):
+    a, b = substations
+    write(a, DAY, [1, 1], [2, 2])
+    write(b, DAY, [3, 1], [1, 2])
+    write(b, DAY + timedelta(days=1), [2], [1])
+    summaries = substation_summary(DAY, 2)
+    assert [summary['name'] for summary in summaries] == ['B', 'A']
+    b_summary = summaries[0]
+    assert [day['date'] for day in b_summary['days']] == ['2030-01-01', '2030-01-02']
+    assert b_summary['generation_energy'] == pytest.approx(1.5)
+    assert b_summary['reverse_flow_hours'] == 0.5
+    assert b_summary['reverse_flow_risk'] is True
+    assert summaries[1]['reverse_flow_risk'] is False
+
+
+def test_summary_endpoint_starts_at_midnight(app, substations):
+    a, _ = substations
+    write(a, DAY + timedelta(hours=1), [1], [2])
+    body = app.test_client().get('/api/summary?start=2030-01-01T05:00&days=1').get_json()
+    assert body['start'] == '2030-01-01T00:00:00'
+    summary = next(summary for summary in body['substations'] if summary['id'] == a)
+    assert [day['date'] for day in summary['days']] == ['2030-01-01']
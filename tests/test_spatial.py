@@ -0,0 +1,81 @@
+import pytest
+
+import spatial
+from models import db, GridSubstation
+from queries import nearest, points_in_bbox, within_km
+
+POINTS = {
+    'colombo': (6.93, 79.85),
+    'kandy': (7.29, 80.63),
+    'jaffna': (9.66, 80.01),
+    'west of the antimeridian': (-17.0, 179.98),
+    'east of the antimeridian': (-17.0, -179.98),
+    'far east': (-17.0, -170.0),
+}
+
+
+@pytest.fixture
+def substations(app):
+    for i, (name, (latitude, longitude)) in enumerate(POINTS.items()):
+        db.session.add(GridSubstation(name=name, code=f'S{i}', latitude=latitude, longitude=longitude))
+    db.session.commit()
+
+
+def names(rows):
+    return sorted(row.name for row in rows)
+
+
+def test_cell_ranges_split_at_the_antimeridian():
+    assert spatial.cell_ranges(0.0, 179.0, 0.0, -179.0) == [
+        (spatial.grid_cell(0.0, 179.0), spatial.grid_cell(0.0, 180.0)),
+        (spatial.grid_cell(0.0, -180.0), spatial.grid_cell(0.0, -179.0)),
+    ]
+
+
+def test_cell_ranges_clamp_to_the_globe():
+    assert spatial.cell_ranges(5.9, 500.0, 9.8, 10.0) == spatial.cell_ranges(5.9, 180.0, 9.8, 10.0)
+    assert spatial.cell_ranges(-100.0, -200.0, 100.0, 200.0)[0][0] == 0
+
+
+def test_points_in_bbox(substations):
+    assert names(points_in_bbox(GridSubstation, 6.5, 79.5, 8.0, 81.0, 10)) == ['colombo', 'kandy']
+
+
+def test_points_in_bbox_across_the_antimeridian(substations):
+    rows = points_in_bbox(GridSubstation, -18.0, 179.9, -16.0, -179.9, 10)
+    assert names(rows) == ['east of the antimeridian', 'west of the antimeridian']
+
+
+@pytest.mark.parametrize('origin', [POINTS['colombo'], POINTS['west of the antimeridian'], (0.0, 0.0)])
+@pytest.mark.parametrize('limit', [1, 2, 4])
+def test_nearest_matches_brute_force(substations, origin, limit):
+    expected = sorted(POINTS, key=lambda name: spatial.haversine_km(*origin, *POINTS[name]))[:limit]
+    found = nearest(GridSubstation, *origin, limit)
+    assert [row.name for row, _ in found] == expected
+    assert [distance for _, distance in found] == sorted(distance for _, distance in found)
+
+
+def test_within_km_across_the_antimeridian(substations):
+    found = within_km(GridSubstation, -17.0, 179.99, 10)
+    assert names(row for row, _ in found) == ['east of the antimeridian', 'west of the antimeridian']
+
+
+@pytest.mark.parametrize('url', [
+    '/api/map/points?bbox=5.9,500,9.8,10',
+    '/api/map/points?bbox=5.9,79.6,9.8,-181',
+    '/api/map/points?bbox=-91,79.6,9.8,81.9',
+    '/api/map/points?bbox=nan,79.6,9.8,81.9',
+    '/api/map/points?bbox=5.9,79.6,9.8',
+    '/api/map/nearby?lat=7&lng=500',
+    '/api/map/nearby?lat=91&lng=80',
+    '/api/map/nearby?lat=7&lng=inf',
+    '/api/map/nearby?lat=7&lng=80&km=nan',
+])
+def test_invalid_coordinates_are_rejected(app, url):
+    assert app.test_client().get(url).status_code == 400
+
+
+def test_nearby_endpoint(app, substations):
+    response = app.test_client().get('/api/map/nearby?lat=6.93&lng=79.85&limit=2&layer=substations')
+    assert response.status_code == 200
+    assert [point['name'] for point in response.get_json()['substations']] == ['colombo', 'kandy']